@@ -45,7 +45,7 @@ class ProjectInline(admin.StackedInline):
 
 @admin.register(Node)
 class NodeAdmin(admin.ModelAdmin):
-    readonly_fields = ['hostname', 'count_projects_on', 'last_active']
+    readonly_fields = ['hostname', 'count_projects_on', 'last_active', 'disk_free']
     fields = readonly_fields + ['enabled', 'use_datadir_subdirs']
 
     inlines = [ProjectInline]
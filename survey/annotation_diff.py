@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# In-process type annotation differ for Python and TypeScript.  Rather than a
+# full tree diff, both sides are parsed with tree-sitter, the annotation nodes
+# are collected and keyed by what they annotate, and the resulting edits are
+# reported as GumTree-style actions so that `is_diff_relevant' can consume them.
+#
+# Keys contain names, so renaming a function, class or parameter changes the
+# keys of the annotations within it.  Annotations left over after matching by
+# key are therefore aligned in document order, first by their text, then by
+# kind, like a tree matcher would pair them.  Only names which are gone from
+# the other side count as renamed: an annotation moved between parameters or
+# functions which exist on both sides is deleted and inserted.
+
+import threading
+import time
+from collections import defaultdict
+from difflib import SequenceMatcher
+from decouple import config
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    from tree_sitter import Language, Parser
+except ImportError:
+    Language = None # type: ignore[misc,assignment]
+    Parser = None # type: ignore[misc,assignment]
+
+GUMTREE_TREE_SITTER_DIR = config('GUMTREE_TREE_SITTER_DIR', default='')
+TREE_SITTER_LIBRARY = config('TREE_SITTER_LIBRARY',
+                             default=(str(Path(GUMTREE_TREE_SITTER_DIR) / 'build' / 'my-languages.so')
+                                      if GUMTREE_TREE_SITTER_DIR != '' else ''))
+
+ANNOTATION_NODES = {
+    'python': {'type'},
+    'typescript': {'type_annotation'}
+}
+
+# Binding packages which may be used when no shared library has been built.
+LANGUAGE_BINDINGS = {
+    'python': ('tree_sitter_python', 'language'),
+    'typescript': ('tree_sitter_typescript', 'language_typescript')
+}
+
+# Parsers can't be shared between threads, each thread builds its own.
+_local = threading.local()
+
+def _load_language(language: str):
+    if TREE_SITTER_LIBRARY != '' and Path(TREE_SITTER_LIBRARY).exists():
+        return Language(TREE_SITTER_LIBRARY, language)
+    module_name, function_name = LANGUAGE_BINDINGS[language]
+    module = __import__(module_name)
+    return Language(getattr(module, function_name)(), language)
+
+def get_parser(language: str) -> Optional['Parser']:
+    if not hasattr(_local, 'parsers'):
+        _local.parsers = {}
+    parsers: Dict[str, Optional['Parser']] = _local.parsers
+    if language not in parsers:
+        parsers[language] = None
+        if Parser is not None and language in ANNOTATION_NODES:
+            try:
+                parser = Parser()
+                parser.set_language(_load_language(language))
+                parsers[language] = parser
+            except Exception:
+                pass
+    return parsers[language]
+
+def is_available(language: str) -> bool:
+    return get_parser(language) is not None
+
+def _text(node, source: bytes) -> str:
+    return source[node.start_byte:node.end_byte].decode('utf-8', errors='replace')
+
+def _defines_scope(node) -> bool:
+    return bool(node.type.endswith(('_definition', '_declaration', '_signature')))
+
+def _annotation_key(node, source: bytes) -> Tuple:
+    parent = node.parent
+
+    target = None
+    for field in ('name', 'pattern', 'left'):
+        child = parent.child_by_field_name(field)
+        if child is not None and child != node:
+            target = _text(child, source)
+            break
+    if target is None:
+        for child in parent.named_children:
+            if child != node:
+                target = _text(child, source)
+                break
+
+    return_type = parent.child_by_field_name('return_type')
+    role = 'return' if return_type is not None and return_type == node else 'annotation'
+
+    scope = []
+    ancestor = parent.parent
+    while ancestor is not None:
+        if _defines_scope(ancestor):
+            name = ancestor.child_by_field_name('name')
+            if name is not None:
+                scope.append(_text(name, source))
+        ancestor = ancestor.parent
+
+    return (tuple(reversed(scope)), parent.type, target, role)
+
+# Nodes visited between checks of the deadline.
+DEADLINE_CHECK_INTERVAL = 4096
+
+def remaining_time(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Annotation diff timed out.")
+    return remaining
+
+def collect_annotations(source: bytes, language: str, timeout: Optional[float] = None) -> Dict[Tuple, Any]:
+    # The timeout covers parsing and walking the tree.
+    deadline = time.monotonic() + timeout if timeout else None
+    parser = get_parser(language)
+    if parser is None:
+        raise ValueError("No tree-sitter grammar available.", language)
+    # Parsing only fails when it runs out of time, which leaves the parser to be reset.
+    parser.set_timeout_micros(int(timeout * 1000000) if timeout else 0)
+    try:
+        tree = parser.parse(source)
+    except ValueError as ex:
+        parser.reset()
+        raise TimeoutError("Parsing timed out.", timeout) from ex
+    node_types = ANNOTATION_NODES[language]
+
+    annotations = {}
+    occurrences: Dict[Tuple, int] = defaultdict(int)
+    stack = [tree.root_node]
+    visited = 0
+    while len(stack) > 0:
+        visited += 1
+        if visited % DEADLINE_CHECK_INTERVAL == 0:
+            remaining_time(deadline)
+        node = stack.pop()
+        if node.type in node_types and node.parent is not None:
+            key = _annotation_key(node, source)
+            annotations[key + (occurrences[key],)] = node
+            occurrences[key] += 1
+            # Annotations nested within annotations belong to the outer one.
+            continue
+        stack.extend(reversed(node.children))
+    return annotations
+
+class _Offsets:
+
+    def __init__(self, source: bytes):
+        self.source = source
+        self.ascii = source.isascii()
+
+    def __call__(self, byte_offset: int) -> int:
+        if self.ascii:
+            return byte_offset
+        return len(self.source[:byte_offset].decode('utf-8', errors='replace'))
+
+    def span(self, node) -> str:
+        return f'{node.type} [{self(node.start_byte)},{self(node.end_byte)}]'
+
+def _normalized(node, source: bytes) -> str:
+    return ''.join(_text(node, source).split())
+
+def _shape(key: Tuple) -> Tuple:
+    # The kind of annotation, independent of any names: what it is attached to and its role.
+    return key[1], key[3]
+
+# Nodes naming what an annotation may be attached to.
+NAME_NODES = {'identifier', 'property_identifier', 'private_property_identifier', 'type_identifier',
+              'shorthand_property_identifier_pattern', 'attribute', 'member_expression'}
+
+def collect_names(root, source: bytes, deadline: Optional[float] = None) -> Set[Tuple[Tuple, str]]:
+    # The names used in each scope (as in `_annotation_key'), definitions
+    # being named within the scope they are defined in.
+    names = set()
+    stack: List[Tuple[Any, Tuple[str, ...]]] = [(root, ())]
+    visited = 0
+    while len(stack) > 0:
+        visited += 1
+        if visited % DEADLINE_CHECK_INTERVAL == 0:
+            remaining_time(deadline)
+        node, scope = stack.pop()
+        if node.type in NAME_NODES:
+            names.add((scope, _text(node, source)))
+        if _defines_scope(node):
+            name = node.child_by_field_name('name')
+            if name is not None:
+                names.add((scope, _text(name, source)))
+                scope = scope + (_text(name, source),)
+        stack.extend((child, scope) for child in reversed(node.children))
+    return names
+
+def _root(node):
+    while node.parent is not None:
+        node = node.parent
+    return node
+
+def _scope_exists(scope: Tuple, names: Set[Tuple[Tuple, str]]) -> bool:
+    return len(scope) == 0 or (scope[:-1], scope[-1]) in names
+
+def _may_pair(a_key: Tuple, b_key: Tuple, a_names: Set[Tuple[Tuple, str]], b_names: Set[Tuple[Tuple, str]]) -> bool:
+    # Annotations which changed along with a rename still share their scope or
+    # their target.  Names which are still around on the other side weren't
+    # renamed though: the annotation moved from one to another.
+    if _shape(a_key) != _shape(b_key):
+        return False
+    a_scope, b_scope = a_key[0], b_key[0]
+    a_target, b_target = a_key[2], b_key[2]
+    if a_scope == b_scope:
+        return a_target == b_target or ((a_scope, a_target) not in b_names and (b_scope, b_target) not in a_names)
+    if a_target == b_target:
+        return not _scope_exists(a_scope, b_names) and not _scope_exists(b_scope, a_names)
+    return False
+
+def match_annotations(a_annotations: Dict[Tuple, Any], a_source: bytes,
+                      b_annotations: Dict[Tuple, Any], b_source: bytes,
+                      deadline: Optional[float] = None) -> Tuple[List[Tuple[Any, Any]], List[Any], List[Any]]:
+    # Returns the matched (a, b) pairs, and the unmatched annotations of either side.
+    pairs = [(node, b_annotations[key]) for key, node in a_annotations.items() if key in b_annotations]
+    a_rest = [(key, node) for key, node in a_annotations.items() if key not in b_annotations]
+    b_rest = [(key, node) for key, node in b_annotations.items() if key not in a_annotations]
+    if len(a_rest) == 0 or len(b_rest) == 0:
+        return pairs, [node for _, node in a_rest], [node for _, node in b_rest]
+
+    # Names are only needed to tell renames from moves.
+    a_names = collect_names(_root(a_rest[0][1]), a_source, deadline)
+    b_names = collect_names(_root(b_rest[0][1]), b_source, deadline)
+    matcher = SequenceMatcher(None,
+                              [_shape(key) + (_normalized(node, a_source),) for key, node in a_rest],
+                              [_shape(key) + (_normalized(node, b_source),) for key, node in b_rest],
+                              autojunk=False)
+    deleted: List[Any] = []
+    inserted: List[Any] = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        candidates = b_rest[j1:j2]
+        for a_key, a_node in a_rest[i1:i2]:
+            match = next((candidate for candidate in candidates
+                          if _may_pair(a_key, candidate[0], a_names, b_names)), None)
+            if match is None:
+                deleted.append(a_node)
+            else:
+                pairs.append((a_node, match[1]))
+                candidates.remove(match)
+        inserted.extend(node for _, node in candidates)
+    return pairs, deleted, inserted
+
+def diff_annotations(a_source: bytes, b_source: bytes, language: str,
+                     timeout: Optional[float] = None) -> Dict[str, List[dict]]:
+    a_offsets = _Offsets(a_source)
+    b_offsets = _Offsets(b_source)
+
+    # Both sides share the timeout.
+    deadline = time.monotonic() + timeout if timeout else None
+    a_annotations = collect_annotations(a_source, language, remaining_time(deadline))
+    b_annotations = collect_annotations(b_source, language, remaining_time(deadline))
+    pairs, deleted, inserted = match_annotations(a_annotations, a_source, b_annotations, b_source, deadline)
+    remaining_time(deadline)
+
+    actions = []
+    for node in deleted:
+        actions.append({'action': 'delete-tree',
+                        'tree': a_offsets.span(node),
+                        'parent': a_offsets.span(node.parent)})
+    for node, b_node in pairs:
+        if _normalized(node, a_source) != _normalized(b_node, b_source):
+            actions.append({'action': 'update-node',
+                            'tree': a_offsets.span(node),
+                            'parent': a_offsets.span(node.parent),
+                            'label': _text(b_node, b_source)})
+    for node in inserted:
+        actions.append({'action': 'insert-tree',
+                        'tree': b_offsets.span(node),
+                        'parent': b_offsets.span(node.parent)})
+
+    return {'matches': [], 'actions': actions}
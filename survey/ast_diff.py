@@ -1,17 +1,55 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-from git import Diff, Commit
+from git import Diff, Commit, GitCommandError
 from tempfile import NamedTemporaryFile
 from pathlib import Path
-from typing import Union, Optional
+from typing import Union, Optional, List, Tuple, Dict
 import subprocess
 from subprocess import CalledProcessError
 from decouple import config
 import json
+import logging
+import os
+import re
+import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from bisect import bisect_right
+from enum import StrEnum
+from itertools import accumulate
+
+from .gumtree_server import GumTreeServer, GumTreeServerError, GumTreeServerStartError
+from .diff_cache import DiffCache
+from .git_utils import prefetch_blobs
+from . import annotation_diff
+
+logger = logging.getLogger(__name__)
+
+tree_re = re.compile(r'^(typed_parameter|type_annotation|type|union_type|help)', re.IGNORECASE)
 
 GUMTREE_DIR = config('GUMTREE_DIR', default='')
 GUMTREE_TREE_SITTER_DIR = config('GUMTREE_TREE_SITTER_DIR', default='')
+GUMTREE_LIB_DIR = config('GUMTREE_LIB_DIR', default=(str(Path(GUMTREE_DIR).parent / 'lib') if GUMTREE_DIR != '' else ''))
+GUMTREE_SERVER = config('GUMTREE_SERVER', default=True, cast=bool)
+GUMTREE_SERVER_TIMEOUT = config('GUMTREE_SERVER_TIMEOUT', default=300, cast=float)
+
+AST_DIFF_ENGINE = config('AST_DIFF_ENGINE', default='tree-sitter')
+
+AST_DIFF_CACHE = config('AST_DIFF_CACHE', default=str(Path(config('DATA_DIR', default='./data/')) / '.astdiff-cache.sqlite3'))
+AST_DIFF_CACHE_SIZE = config('AST_DIFF_CACHE_SIZE', default=1024, cast=int) # MiB
+
+AST_DIFF_PREFILTER = config('AST_DIFF_PREFILTER', default='conservative')
+
+# Files of a single commit may be diffed by concurrent GumTree servers; each
+# file gets its own time limit.  tree-sitter diffs hold the GIL and always run
+# one after the other.
+AST_DIFF_WORKERS = config('AST_DIFF_WORKERS', default=1, cast=int)
+AST_DIFF_FILE_TIMEOUT = config('AST_DIFF_FILE_TIMEOUT', default=GUMTREE_SERVER_TIMEOUT, cast=float)
+
+# Pairs which timed out or crashed the differ this often are not diffed again.
+AST_DIFF_FAILURE_ATTEMPTS = config('AST_DIFF_FAILURE_ATTEMPTS', default=3, cast=int)
 
 ENVIRONMENT_FOR_GUMTREE = {
     'PATH': config('PATH', default='')
@@ -44,55 +82,524 @@ LANGUAGE_SUFFIXES = {
     'php': '.php'
 }
 
+# Files considered to be in a language; Python stubs only hold annotations.
+LANGUAGE_EXTENSIONS = {
+    'py': ('.py', '.pyi'),
+    'python': ('.py', '.pyi'),
+    'ts': ('.ts',),
+    'typescript': ('.ts',),
+    'r': ('.r',),
+    'rb': ('.rb',),
+    'ruby': ('.rb',),
+    'php': ('.php',)
+}
+
+TREE_SITTER_LANGUAGES = {
+    'py': 'python',
+    'python': 'python',
+    'ts': 'typescript',
+    'typescript': 'typescript'
+}
+
+ENGINES = ['tree-sitter', 'gumtree']
+
+_local = threading.local()
+
+# Set in a process whose GumTree server failed to start; it uses the command line client from then on.
+_gumtree_server_unavailable_pid: Optional[int] = None
+
+def gumtree_server_failed(ex: GumTreeServerStartError):
+    global _gumtree_server_unavailable_pid
+    if _gumtree_server_unavailable_pid != os.getpid():
+        logger.warning(f'GumTree server unavailable, using the command line client instead: {ex!r}')
+        _gumtree_server_unavailable_pid = os.getpid()
+
+def get_gumtree_server() -> Optional[GumTreeServer]:
+    if not GUMTREE_SERVER or GUMTREE_LIB_DIR == '' or _gumtree_server_unavailable_pid == os.getpid():
+        return None
+    # Each (forked) worker process, and each thread within it, gets its own server.
+    if getattr(_local, 'gumtree_server', None) is None or _local.gumtree_server_pid != os.getpid():
+        _local.gumtree_server = GumTreeServer(GUMTREE_LIB_DIR, ENVIRONMENT_FOR_GUMTREE,
+                                              timeout=GUMTREE_SERVER_TIMEOUT)
+        _local.gumtree_server_pid = os.getpid()
+    server: GumTreeServer = _local.gumtree_server
+    return server
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+
+def get_executor() -> Optional[ThreadPoolExecutor]:
+    global _executor, _executor_pid
+    if AST_DIFF_WORKERS <= 1:
+        return None
+    # Threads (and their GumTree servers) are kept for later commits, but not across forks.
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=AST_DIFF_WORKERS, thread_name_prefix='astdiff')
+        _executor_pid = os.getpid()
+    return _executor
+
+_diff_cache: Optional[DiffCache] = None
+
+def get_diff_cache() -> Optional[DiffCache]:
+    global _diff_cache
+    if AST_DIFF_CACHE == '':
+        return None
+    if _diff_cache is None:
+        _diff_cache = DiffCache(AST_DIFF_CACHE, AST_DIFF_CACHE_SIZE * 1024 * 1024)
+    return _diff_cache
+
+_counters: Dict[str, int] = defaultdict(int)
+
+def count(name: str, amount: int = 1):
+    # Counters are kept with the cache so that they are node-wide; without a
+    # cache they only live as long as the process.
+    _counters[name] += amount
+    cache = get_diff_cache()
+    if cache is not None:
+        cache.increment(name, amount)
+
+def diff_cache_key(a_sha: str, b_sha: str, backend: str) -> str:
+    return f'{a_sha}:{b_sha}:{backend}'
+
+def diff_backend(language: str, engine: Optional[str] = None) -> str:
+    engine = engine or AST_DIFF_ENGINE
+    if engine == 'tree-sitter' and language in TREE_SITTER_LANGUAGES \
+       and annotation_diff.is_available(TREE_SITTER_LANGUAGES[language]):
+        return f'tree-sitter-{TREE_SITTER_LANGUAGES[language]}'
+    return LANGUAGE_BACKENDS[language]
+
+def is_tree_sitter_backend(backend: str) -> bool:
+    return backend.startswith('tree-sitter-')
+
+def tree_sitter_diff(a_data: bytes, b_data: bytes, backend: str, timeout: Optional[float] = None) -> str:
+    return json.dumps(annotation_diff.diff_annotations(a_data, b_data, backend[len('tree-sitter-'):], timeout))
+
+def gumtree_textdiff(a_file: str, b_file: str, generator: str, timeout: Optional[float] = None) -> str:
+    diff_proc = subprocess.run(['gumtree', 'textdiff',
+                                '-f', 'json',
+                                '-g', generator,
+                                a_file, b_file],
+                               capture_output=True,
+                               env=ENVIRONMENT_FOR_GUMTREE,
+                               timeout=timeout,
+                               check=True)
+    if len(diff_proc.stdout.decode()) == 0:
+        raise ValueError("AST Diff Generation Failed, no output.",
+                         diff_proc.stderr.decode())
+    return diff_proc.stdout.decode()
+
+def gumtree_textdiff_data(a_data: bytes, b_data: bytes, generator: str, suffix: str,
+                          timeout: Optional[float] = None) -> str:
+    with NamedTemporaryFile(suffix=suffix) as pre_diff, \
+         NamedTemporaryFile(suffix=suffix) as post_diff:
+        pre_diff.write(a_data)
+        pre_diff.flush()
+        post_diff.write(b_data)
+        post_diff.flush()
+        return gumtree_textdiff(pre_diff.name, post_diff.name, generator, timeout)
+
+def gumtree_diff(a_data: bytes, b_data: bytes, generator: str, suffix: str, timeout: Optional[float] = None) -> str:
+    server = get_gumtree_server()
+    if server is not None:
+        try:
+            return server.diff(generator, a_data, b_data, timeout=timeout)
+        except GumTreeServerStartError as ex:
+            gumtree_server_failed(ex)
+        except GumTreeServerError:
+            pass
+    # Only the command line client needs the contents on disk.
+    return gumtree_textdiff_data(a_data, b_data, generator, suffix, timeout)
+
+def gumtree_diff_batch(pairs: List[Tuple[bytes, bytes]], generator: str, suffix: str) -> List[Union[str, Exception]]:
+    server = get_gumtree_server()
+    if server is not None:
+        try:
+            return server.diff_batch(generator, pairs)
+        except GumTreeServerStartError as ex:
+            gumtree_server_failed(ex)
+        except GumTreeServerError:
+            pass
+
+    results: List[Union[str, Exception]] = []
+    for a_data, b_data in pairs:
+        try:
+            results.append(gumtree_textdiff_data(a_data, b_data, generator, suffix, AST_DIFF_FILE_TIMEOUT))
+        except (ValueError, CalledProcessError, subprocess.TimeoutExpired, OSError) as ex:
+            results.append(ex)
+    return results
+
+def compute_diff(a_data: bytes, b_data: bytes, backend: str, suffix: str, timeout: Optional[float] = None) -> str:
+    if is_tree_sitter_backend(backend):
+        return tree_sitter_diff(a_data, b_data, backend, timeout)
+    return gumtree_diff(a_data, b_data, backend, suffix, timeout)
+
+def compute_diff_concurrent(executor: ThreadPoolExecutor, pairs: List[Tuple[bytes, bytes]], backend: str, suffix: str,
+                            timeout: float = AST_DIFF_FILE_TIMEOUT) -> List[Union[str, Exception]]:
+    # Results are returned in the order of `pairs', however the threads finish.
+    # A diff still running when its time is up is left to the server's own timeout.
+    futures = [executor.submit(compute_diff, a_data, b_data, backend, suffix, timeout)
+               for a_data, b_data in pairs]
+    results: List[Union[str, Exception]] = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=timeout))
+        except FutureTimeoutError:
+            # Only a builtin TimeoutError before Python 3.11; counted as a timeout either way.
+            future.cancel()
+            results.append(TimeoutError("AST Diff timed out.", timeout))
+        except Exception as ex:
+            results.append(ex)
+    return results
+
+class DiffFailure(StrEnum):
+    DECODE = 'decode'
+    PARSE = 'parse'
+    TIMEOUT = 'timeout'
+    CRASH = 'crash'
+    ERROR = 'error'
+
+    @classmethod
+    def classify(cls, ex: BaseException) -> 'DiffFailure':
+        # UnicodeDecodeError is a ValueError and TimeoutError an OSError, so the order matters.
+        if isinstance(ex, UnicodeDecodeError):
+            return cls.DECODE
+        if isinstance(ex, (TimeoutError, subprocess.TimeoutExpired)):
+            return cls.TIMEOUT
+        if isinstance(ex, (GumTreeServerError, CalledProcessError, OSError)):
+            return cls.CRASH
+        if isinstance(ex, ValueError):
+            return cls.PARSE
+        return cls.ERROR
+
+    @property
+    def is_permanent(self) -> bool:
+        # The same contents will fail the same way again.
+        return self in (DiffFailure.DECODE, DiffFailure.PARSE)
+
+class KnownDiffFailure(ValueError):
+
+    def __init__(self, failure: DiffFailure, path: str):
+        super().__init__("AST Diff skipped, it failed before.", str(failure), path)
+        self.failure = failure
+
+def known_diff_failure(cache: Optional[DiffCache], key: str) -> Optional[DiffFailure]:
+    known = cache.get_failure(key) if cache is not None else None
+    if known is None:
+        return None
+    failure, attempts = DiffFailure(known[0]), known[1]
+    if failure.is_permanent or attempts >= AST_DIFF_FAILURE_ATTEMPTS:
+        return failure
+    return None
+
+def record_diff_failure(cache: Optional[DiffCache], key: str, language: str, ex: BaseException) -> DiffFailure:
+    failure = DiffFailure.classify(ex)
+    count(f'failed_{language}_{failure}')
+    if cache is not None:
+        cache.put_failure(key, failure)
+    return failure
+
+class ActionType(StrEnum):
+    INSERT_TREE = 'insert-tree'
+    INSERT_NODE = 'insert-node'
+    UPDATE_NODE = 'update-node'
+    DELETE_TREE = 'delete-tree'
+    DELETE_NODE = 'delete-node'
+    MOVE_TREE = 'move-tree'
+
+    @property
+    def is_insert(self) -> bool:
+        return self in (ActionType.INSERT_TREE, ActionType.INSERT_NODE)
+
+    @property
+    def is_update(self) -> bool:
+        return self is ActionType.UPDATE_NODE
+
+class Node:
+    __slots__ = ('kind', 'start', 'end', 'is_type')
+
+    def __init__(self, kind: str, start: int, end: int):
+        self.kind = sys.intern(kind)
+        self.start = start
+        self.end = end
+        self.is_type = tree_re.match(kind) is not None
+
+    @classmethod
+    def parse(cls, text: str) -> 'Node':
+        # GumTree writes nodes as `kind [start,end]' or `kind: label [start,end]'.
+        bracket = text.rindex('[')
+        start, end = text[bracket + 1:text.rindex(']')].split(',')
+        return cls(text[:bracket].split(':', 1)[0].strip(), int(start), int(end))
+
+    def __str__(self):
+        return f'{self.kind} [{self.start},{self.end}]'
+
+    def __repr__(self):
+        return f'Node({self})'
+
+class Action:
+    __slots__ = ('type', 'tree', 'parent', 'label')
+
+    def __init__(self, type: ActionType, tree: Node, parent: Optional[Node] = None, label: Optional[str] = None):
+        self.type = type
+        self.tree = tree
+        self.parent = parent
+        self.label = label
+
+    @classmethod
+    def from_json(cls, action: dict) -> 'Action':
+        return cls(ActionType(action['action']),
+                   Node.parse(action['tree']),
+                   Node.parse(action['parent']) if 'parent' in action else None,
+                   action.get('label'))
+
+    def as_dict(self) -> Dict[str, str]:
+        result = {'action': str(self.type), 'tree': str(self.tree)}
+        if self.parent is not None:
+            result['parent'] = str(self.parent)
+        if self.label is not None:
+            result['label'] = self.label
+        return result
+
+    def __repr__(self):
+        return f'Action({self.as_dict()})'
+
+class Match:
+    __slots__ = ('src', 'dest')
+
+    def __init__(self, src: Node, dest: Node):
+        self.src = src
+        self.dest = dest
+
+    @classmethod
+    def from_json(cls, match: dict) -> 'Match':
+        return cls(Node.parse(match['src']), Node.parse(match['dest']))
+
+    def __repr__(self):
+        return f'Match({self.src}, {self.dest})'
+
+def parse_diff(diff_data: str) -> Tuple[List[Action], List[Match]]:
+    diff_json = json.loads(diff_data)
+    return ([Action.from_json(action) for action in diff_json.get('actions', [])],
+            [Match.from_json(match) for match in diff_json.get('matches', [])])
+
+class TypeTreeIndex:
+
+    def __init__(self, spans: List[Tuple[int, int]]):
+        spans = sorted(spans)
+        self.starts = [start for start, _ in spans]
+        # Largest end among all spans starting at or before each start.
+        self.max_ends = list(accumulate((end for _, end in spans), max))
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_matches(cls, matches: List[Match], side: str = 'a'):
+        # Matched trees of the old (`a') or the new (`b') side.
+        trees = [match.src if side == 'a' else match.dest for match in matches]
+        return cls([(tree.start, tree.end) for tree in trees if tree.is_type])
+
+    def contains(self, start: int, end: int) -> bool:
+        i = bisect_right(self.starts, start)
+        return i > 0 and self.max_ends[i - 1] >= end
+
+class LineIndex:
+
+    def __init__(self, text: str):
+        self.text = text
+        self.starts = [0] + [match.end() for match in re.finditer('\n', text)]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def line_of(self, offset: int) -> int:
+        return bisect_right(self.starts, offset)
+
+    def line_text(self, line: int) -> str:
+        if line < 1:
+            raise IndexError("Line numbers start at 1.", line)
+        start = self.starts[line - 1]
+        end = self.starts[line] - 1 if line < len(self.starts) else len(self.text)
+        return self.text[start:end]
+
 class AstDiff:
 
-    def __init__(self, a_file: Union[str, Path], b_file: Union[str, Path], language: str):
+    def __init__(self, a_file: Union[str, Path], b_file: Union[str, Path], language: str,
+                 engine: Optional[str] = None):
         self.a_name = str(a_file)
         self.b_name = str(b_file)
 
-        with open(self.a_name, 'r') as fh:
-            self.a_data = fh.read()
-
-        with open(self.b_name, 'r') as fh:
-            self.b_data = fh.read()
-
-        diff_proc = subprocess.run(['gumtree', 'textdiff',
-                                    '-f', 'json',
-                                    '-g', LANGUAGE_BACKENDS[language],
-                                    self.a_name, self.b_name],
-                                   capture_output=True,
-                                   env=ENVIRONMENT_FOR_GUMTREE,
-                                   check=True)
-        if len(diff_proc.stdout.decode()) == 0:
-            raise ValueError("AST Diff Generation Failed, no output.",
-                             diff_proc.stderr.decode())
-        self._diff_data_json = diff_proc.stdout.decode()
-        self._diff_json = json.loads(self._diff_data_json)
+        a_data = Path(a_file).read_bytes()
+        b_data = Path(b_file).read_bytes()
+        self.a_data = a_data.decode()
+        self.b_data = b_data.decode()
+
+        self.backend = diff_backend(language, engine)
+        self._load(compute_diff(a_data, b_data, self.backend, LANGUAGE_SUFFIXES[language]))
+
+    def _load(self, diff_data: str):
+        # Only the parsed records are kept; the JSON text is dropped here.
+        self.actions, self.matches = parse_diff(diff_data)
+        self._type_trees: Dict[str, TypeTreeIndex] = {}
+        self._a_lines: Optional[LineIndex] = None
+        self._b_lines: Optional[LineIndex] = None
+
+    @classmethod
+    def _from_data(cls, a_name: str, b_name: str, a_data: str, b_data: str, backend: str, diff_data: str):
+        obj = cls.__new__(cls)
+        obj.a_name = a_name
+        obj.b_name = b_name
+        obj.a_data = a_data
+        obj.b_data = b_data
+        obj.backend = backend
+        obj._load(diff_data)
+        return obj
 
     def __str__(self):
         return f'AstDiff(\'{self.a_name}\', \'{self.b_name}\')'
 
     @property
-    def actions(self):
-        if 'actions' in  self._diff_json.keys():
-            return self._diff_json['actions']
+    def a_lines(self) -> LineIndex:
+        if self._a_lines is None:
+            self._a_lines = LineIndex(self.a_data)
+        return self._a_lines
 
     @property
-    def matches(self):
-        if 'matches' in self._diff_json.keys():
-            return self._diff_json['matches']
+    def b_lines(self) -> LineIndex:
+        if self._b_lines is None:
+            self._b_lines = LineIndex(self.b_data)
+        return self._b_lines
+
+    def line_of(self, offset: int, side: str = 'a') -> int:
+        return (self.a_lines if side == 'a' else self.b_lines).line_of(offset)
+
+    def line_text(self, line: int, side: str = 'a') -> str:
+        return (self.a_lines if side == 'a' else self.b_lines).line_text(line)
+
+    def type_trees(self, side: str = 'a') -> TypeTreeIndex:
+        if side not in self._type_trees:
+            self._type_trees[side] = TypeTreeIndex.from_matches(self.matches, side)
+        return self._type_trees[side]
 
     @classmethod
-    def from_diff(cls, commit: Commit, diff: Diff, language: str, suffix: Optional[str] = None):
+    def from_diff(cls, commit: Commit, diff: Diff, language: str, suffix: Optional[str] = None,
+                  engine: Optional[str] = None):
         if suffix is None:
             suffix = LANGUAGE_SUFFIXES[language]
-        with NamedTemporaryFile(suffix=suffix) as pre_diff, \
-             NamedTemporaryFile(suffix=suffix) as post_diff:
-            pre_diff.write(diff.b_blob.data_stream.read())
-            pre_diff.flush()
-            post_diff.write(diff.a_blob.data_stream.read())
-            post_diff.flush()
-            obj = cls(pre_diff.name, post_diff.name, language)
-            obj.a_name = f'{diff.a_path}'
-            obj.b_name = f'{diff.b_path}'
+        backend = diff_backend(language, engine)
+        if diff.a_blob is None or diff.b_blob is None:
+            raise ValueError("File was added or deleted.", diff.a_path, diff.b_path)
+        cls.prefetch(commit, [diff])
+
+        # Blob contents are read straight from the object database and kept in memory.
+        pre_data = diff.b_blob.data_stream.read()
+        post_data = diff.a_blob.data_stream.read()
+        a_data, b_data = pre_data.decode(), post_data.decode()
+
+        cache = get_diff_cache()
+        key = diff_cache_key(diff.b_blob.hexsha, diff.a_blob.hexsha, backend)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            return cls._from_data(f'{diff.a_path}', f'{diff.b_path}', a_data, b_data, backend, cached)
+
+        diff_data = compute_diff(pre_data, post_data, backend, suffix)
+        obj = cls._from_data(f'{diff.a_path}', f'{diff.b_path}', a_data, b_data, backend, diff_data)
+        if cache is not None:
+            cache.put(key, diff_data)
         return obj
+
+    @classmethod
+    def batch_from_commit(cls, commit: Commit, language: str,
+                          paths: Optional[List[str]] = None,
+                          engine: Optional[str] = None,
+                          prefetch: bool = True) -> List[Tuple[Diff, Union['AstDiff', Exception]]]:
+        # Without `prefetch', the caller has already fetched the blobs of a partial clone.
+        suffix = LANGUAGE_SUFFIXES[language]
+        backend = diff_backend(language, engine)
+        cache = get_diff_cache()
+        executor = get_executor() if not is_tree_sitter_backend(backend) else None
+
+        diffs: List[Diff] = list(commit.diff(commit.parents[0], paths=tuple(paths) if paths is not None else None))
+        if paths is None:
+            diffs = [diff for diff in diffs if (diff.b_path or '').lower().endswith(LANGUAGE_EXTENSIONS[language])]
+        if prefetch:
+            cls.prefetch(commit, diffs)
+
+        results: List[Union[AstDiff, Exception, None]] = []
+        pending = []
+        for i, diff in enumerate(diffs):
+            if diff.a_blob is None or diff.b_blob is None:
+                results.append(ValueError("File was added or deleted.", diff.a_path, diff.b_path))
+                continue
+            key = diff_cache_key(diff.b_blob.hexsha, diff.a_blob.hexsha, backend)
+            failure = known_diff_failure(cache, key)
+            if failure is not None:
+                count(f'skipped_{language}_{failure}')
+                results.append(KnownDiffFailure(failure, f'{diff.b_path}'))
+                continue
+            try:
+                cached = cache.get(key) if cache is not None else None
+                if cached is None:
+                    count(f'diffed_{language}')
+                pre_data = diff.b_blob.data_stream.read()
+                post_data = diff.a_blob.data_stream.read()
+                a_data, b_data = pre_data.decode(), post_data.decode()
+                if cached is not None:
+                    results.append(cls._from_data(f'{diff.a_path}', f'{diff.b_path}',
+                                                  a_data, b_data, backend, cached))
+                elif is_tree_sitter_backend(backend):
+                    diff_data = tree_sitter_diff(pre_data, post_data, backend, AST_DIFF_FILE_TIMEOUT)
+                    results.append(cls._from_data(f'{diff.a_path}', f'{diff.b_path}',
+                                                  a_data, b_data, backend, diff_data))
+                    if cache is not None:
+                        cache.put(key, diff_data)
+                else:
+                    results.append(None)
+                    pending.append((i, diff, key, pre_data, post_data, a_data, b_data))
+            except Exception as ex:
+                record_diff_failure(cache, key, language, ex)
+                results.append(ex)
+
+        if len(pending) > 0:
+            pairs = [(pre_data, post_data) for _, _, _, pre_data, post_data, _, _ in pending]
+            if executor is not None:
+                diff_results = compute_diff_concurrent(executor, pairs, backend, suffix)
+            else:
+                diff_results = gumtree_diff_batch(pairs, backend, suffix)
+            for (i, diff, key, _, _, a_data, b_data), result in zip(pending, diff_results):
+                if isinstance(result, Exception):
+                    record_diff_failure(cache, key, language, result)
+                    results[i] = result
+                    continue
+                try:
+                    results[i] = cls._from_data(f'{diff.a_path}', f'{diff.b_path}',
+                                                a_data, b_data, backend, result)
+                except ValueError as ex:
+                    record_diff_failure(cache, key, language, ex)
+                    results[i] = ex
+                    continue
+                if cache is not None:
+                    cache.put(key, result)
+
+        # Every pending diff has its result by now.
+        return [(diff, result) for diff, result in zip(diffs, results) if result is not None]
+
+    @staticmethod
+    def prefetch(commit: Commit, diffs: List[Diff]):
+        AstDiff.prefetch_paths(commit,
+                               [blob.hexsha for diff in diffs
+                                for blob in (diff.a_blob, diff.b_blob) if blob is not None],
+                               [path for diff in diffs for path in dict.fromkeys((diff.a_path, diff.b_path))
+                                if path is not None])
+
+    @staticmethod
+    def prefetch_paths(commit: Commit, blobs: List[str], paths: List[str]):
+        # Partial clones fetch the blobs of all files at once; failures are left to the lazy fetch.
+        if len(blobs) == 0:
+            return
+        try:
+            fetched = prefetch_blobs(commit.repo, [commit.parents[0].hexsha, commit.hexsha], blobs, paths)
+        except GitCommandError:
+            return
+        if fetched > 0:
+            count('blobs_prefetched', fetched)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+class DiffCache:
+
+    def __init__(self, path: Union[str, Path], max_size: int):
+        self.path = Path(path)
+        self.max_size = max_size
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connection_pid: Optional[int] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # sqlite connections must not be shared with forked worker processes.
+        if self._connection is None or self._connection_pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                                     'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                                     'size INTEGER NOT NULL, accessed REAL NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS counters ('
+                                     'name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            # Pairs which failed to diff, so that hopeless ones aren't diffed again.
+            self._connection.execute('CREATE TABLE IF NOT EXISTS failures ('
+                                     'key TEXT PRIMARY KEY, failure TEXT NOT NULL, '
+                                     'attempts INTEGER NOT NULL, recorded REAL NOT NULL)')
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def increment(self, name: str, amount: int = 1):
+        self.connection.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                                'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value',
+                                (name, amount))
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.connection.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.increment('misses')
+            return None
+        self.connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (time.time(), key))
+        self.increment('hits')
+        return zlib.decompress(row[0]).decode()
+
+    def put(self, key: str, value: str):
+        data = zlib.compress(value.encode())
+        self.connection.execute('INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                                (key, data, len(data), time.time()))
+        self.connection.execute('DELETE FROM failures WHERE key = ?', (key,))
+        self.evict()
+
+    def get_failure(self, key: str) -> Optional[Tuple[str, int]]:
+        row = self.connection.execute('SELECT failure, attempts FROM failures WHERE key = ?', (key,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def put_failure(self, key: str, failure: str):
+        self.connection.execute('INSERT INTO failures (key, failure, attempts, recorded) VALUES (?, ?, 1, ?) '
+                                'ON CONFLICT (key) DO UPDATE SET failure = excluded.failure, '
+                                'attempts = attempts + 1, recorded = excluded.recorded',
+                                (key, failure, time.time()))
+
+    def evict(self):
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_size:
+            return
+        excess = total - self.max_size
+        evicted = []
+        for key, size in self.connection.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.connection.executemany('DELETE FROM entries WHERE key = ?', evicted)
+        self.increment('evictions', len(evicted))
+
+    def clear(self):
+        self.connection.execute('DELETE FROM entries')
+        self.connection.execute('DELETE FROM counters')
+        self.connection.execute('DELETE FROM failures')
+        self.connection.execute('VACUUM')
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self.connection.execute('SELECT name, value FROM counters').fetchall())
+        entries, size = self.connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        stats['entries'] = entries
+        stats['size'] = size
+        stats['failures'] = self.connection.execute('SELECT COUNT(*) FROM failures').fetchone()[0]
+        return stats
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Coalesces the fetches of a project's clone.  Pushes arrive in bursts (and
+# webhooks get redelivered), and every one of them used to fetch on its own.
+# Requests whose commits are already present don't fetch at all.  Fetches of
+# a project are serialized by a lock file on the node; a push which waited
+# for another fetch checks for its commits again, and a request for a full
+# fetch which waited for a full fetch that started after it was made is
+# covered by that fetch and returns.  A push only fetches the branch it
+# updated, and only FETCH_CONCURRENCY fetches run on a node at the same time.
+
+import fcntl
+import os
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from decouple import config
+from django.conf import settings
+from git import Repo, GitCommandError
+
+from .models import Project
+
+FETCH_CONCURRENCY = config('FETCH_CONCURRENCY', default=4, cast=int)
+FETCH_SLOT_POLL_INTERVAL = 0.5 # seconds
+
+def lock_dir() -> Path:
+    path = Path(settings.DATA_DIR) / '.locks'
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+@contextmanager
+def project_lock(project: Project) -> Iterator[int]:
+    # The lock file holds the time the project's last full fetch started.
+    fd = os.open(lock_dir() / f'project-{project.id}.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield fd
+    finally:
+        os.close(fd)
+
+def last_fetch_started(fd: int) -> float:
+    os.lseek(fd, 0, os.SEEK_SET)
+    try:
+        return float(os.read(fd, 64).decode() or 0)
+    except ValueError:
+        return 0.0
+
+def record_fetch_start(fd: int, started: float):
+    os.ftruncate(fd, 0)
+    os.pwrite(fd, repr(started).encode(), 0)
+
+@contextmanager
+def fetch_slot() -> Iterator[int]:
+    # One of FETCH_CONCURRENCY lock files, waiting until one is free.
+    fds = [os.open(lock_dir() / f'fetch-slot-{i}.lock', os.O_RDWR | os.O_CREAT, 0o644)
+           for i in range(max(FETCH_CONCURRENCY, 1))]
+    slot = None
+    try:
+        while slot is None:
+            for fd in fds:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    slot = fd
+                    break
+                except BlockingIOError:
+                    continue
+            else:
+                time.sleep(FETCH_SLOT_POLL_INTERVAL)
+        yield slot
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+def has_commits(repo: Repo, shas: List[str]) -> bool:
+    # Checked without fetching missing objects where git supports it.
+    if len(shas) == 0:
+        return False
+    proc = subprocess.run(['git', 'cat-file', '--batch-check'],
+                          input=''.join(f'{sha}\n' for sha in shas),
+                          cwd=repo.git_dir,
+                          env={**os.environ, 'GIT_NO_LAZY_FETCH': '1'},
+                          capture_output=True, text=True, check=True)
+    return all(not line.endswith(' missing') for line in proc.stdout.splitlines())
+
+def pushed_refspec(repo: Repo, ref: Optional[str]) -> Optional[str]:
+    # A pushed branch updates its remote-tracking branch, like a full fetch would.
+    if ref is not None and ref.startswith('refs/heads/'):
+        return f'+{ref}:refs/remotes/{repo.remote().name}/{ref[len("refs/heads/"):]}'
+    return None
+
+def coalesced_fetch(project: Project, shas: Optional[List[str]] = None, ref: Optional[str] = None) -> bool:
+    # Returns whether a fetch was made.
+    requested = time.time()
+    shas = shas or []
+    if ref is not None and len(shas) == 0:
+        # A push without commits (deleting a branch, or pointing one at known commits) has nothing to fetch.
+        return False
+    repo = Repo(project.path)
+    if has_commits(repo, shas):
+        return False
+    with project_lock(project) as fd:
+        if len(shas) > 0:
+            # The fetch waited for may only have been of another branch.
+            if has_commits(repo, shas):
+                return False
+        elif last_fetch_started(fd) >= requested:
+            # Waited for a full fetch which started after this request.
+            return False
+        with fetch_slot():
+            refspec = pushed_refspec(repo, ref)
+            if refspec is not None:
+                try:
+                    repo.remote().fetch(refspec)
+                    if has_commits(repo, shas):
+                        return True
+                except GitCommandError:
+                    # The branch may be gone again already; the full fetch below still gets the commits.
+                    pass
+            record_fetch_start(fd, time.time())
+            repo.remote().fetch()
+        return True
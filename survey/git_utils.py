@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Partial clones of tracked projects.  A clone made with GIT_CLONE_FILTER
+# (e.g. `blob:none') only holds commits and trees; file contents are fetched
+# from the project's remote when they are first read.  Git fetches such blobs
+# one at a time, so the blobs a relevance check is about to read are fetched
+# together first.
+#
+# Full clones may instead borrow their objects from a pool (a bare repository)
+# kept in each data directory of a node, so that forks, renamed and
+# re-installed projects share their objects.  The pool holds the refs of every
+# project sharing it under `refs/projects/<owner>/<name>/', which keeps the
+# objects those projects borrow alive; a project's refs are only dropped once
+# it no longer lives in that data directory.
+
+import subprocess
+from pathlib import Path
+from urllib.parse import unquote
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from decouple import config
+from git import Repo, GitCommandError
+
+GIT_CLONE_FILTER = config('GIT_CLONE_FILTER', default='')
+GIT_OBJECT_POOL = config('GIT_OBJECT_POOL', default=False, cast=bool)
+
+OBJECT_POOL_NAME = '.objects.git'
+POOL_NAMESPACE = 'refs/projects'
+
+# Object ids per fetch, keeping the command line short.
+FETCH_CHUNK_SIZE = 1000
+
+def clone_project(url: str, path: Union[str, Path]) -> Repo:
+    if GIT_CLONE_FILTER != '':
+        return Repo.clone_from(url, path, filter=GIT_CLONE_FILTER)
+    return Repo.clone_from(url, path)
+
+_promisor_remotes: Dict[str, Optional[str]] = {}
+
+def promisor_remote(repo: Repo) -> Optional[str]:
+    # Only partial clones have a remote to fetch missing objects from.
+    git_dir = str(repo.git_dir)
+    if git_dir not in _promisor_remotes:
+        _promisor_remotes[git_dir] = None
+        try:
+            for line in repo.git.config('--get-regexp', r'^remote\..*\.promisor$').splitlines():
+                name, value = line.rsplit(' ', 1)
+                if value == 'true':
+                    _promisor_remotes[git_dir] = name[len('remote.'):-len('.promisor')]
+                    break
+        except GitCommandError:
+            pass
+    return _promisor_remotes[git_dir]
+
+def missing_blobs(repo: Repo, revisions: List[str], blobs: Iterable[str],
+                  paths: Optional[List[str]] = None) -> List[str]:
+    # `--missing=print' reports missing objects instead of fetching them.
+    # With `paths', only those paths of the revisions' trees are walked (the
+    # trees themselves, as a path limit on commits would skip those which
+    # don't change the paths).
+    if paths is not None:
+        output = repo.git.rev_list('--objects', '--missing=print', '--no-walk',
+                                   *(f'{revision}^{{tree}}' for revision in revisions), '--', *paths)
+    else:
+        output = repo.git.rev_list('--objects', '--missing=print', '--no-walk', *revisions)
+    missing = set(line[1:] for line in output.splitlines() if line.startswith('?'))
+    return [blob for blob in dict.fromkeys(blobs) if blob in missing]
+
+def prefetch_blobs(repo: Repo, revisions: List[str], blobs: Iterable[str],
+                   paths: Optional[List[str]] = None) -> int:
+    # Fetches the given blobs of `revisions' (at `paths') which aren't present yet.
+    remote = promisor_remote(repo)
+    if remote is None:
+        return 0
+    missing = missing_blobs(repo, revisions, blobs, paths)
+    for i in range(0, len(missing), FETCH_CHUNK_SIZE):
+        # The same request git makes for a single missing object.
+        repo.git(c='fetch.negotiationAlgorithm=noop').fetch(remote, '--no-tags', '--no-write-fetch-head',
+                                                             '--recurse-submodules=no', '--filter=blob:none',
+                                                             *missing[i:i + FETCH_CHUNK_SIZE])
+    return len(missing)
+
+def object_pool_path(data_root: Path) -> Path:
+    return data_root / OBJECT_POOL_NAME
+
+def get_object_pool(data_root: Path) -> Repo:
+    path = object_pool_path(data_root)
+    if not path.exists():
+        pool = Repo.init(path, bare=True, mkdir=True)
+        # Objects are only ever pruned by `prune_object_pool'.
+        pool.git.config('gc.auto', '0')
+        return pool
+    return Repo(path)
+
+def _ref_component(text: str) -> str:
+    # Repository names may start with a dot, which refs can't.
+    return text.replace('%', '%25').replace('.', '%2E')
+
+def pool_namespace(owner: str, name: str) -> str:
+    return f'{POOL_NAMESPACE}/{_ref_component(owner)}/{_ref_component(name)}'
+
+def share_objects(repo: Repo, data_root: Path, owner: str, name: str) -> bool:
+    # Moves the objects of a clone into the pool, which the clone then borrows
+    # through its alternates.  Partial clones are small already, and their
+    # missing blobs would be fetched when copying them into the pool.
+    if not GIT_OBJECT_POOL or promisor_remote(repo) is not None:
+        return False
+    pool = get_object_pool(data_root)
+    # The refs come first, so the objects are reachable in the pool before
+    # the clone drops its own copies.
+    pool.git.fetch('--no-tags', '--prune', '--quiet', repo.git_dir, f'+refs/*:{pool_namespace(owner, name)}/*')
+
+    alternates = Path(repo.git_dir) / 'objects' / 'info' / 'alternates'
+    pool_objects = str(Path(pool.git_dir) / 'objects')
+    borrowed = alternates.read_text().splitlines() if alternates.exists() else []
+    if pool_objects not in borrowed:
+        alternates.parent.mkdir(parents=True, exist_ok=True)
+        alternates.write_text(''.join(f'{line}\n' for line in borrowed + [pool_objects]))
+
+    # `-l' leaves out everything the pool already has.
+    repo.git.repack('-a', '-d', '-l', '-q')
+    return True
+
+def pooled_projects(pool: Repo) -> Set[Tuple[str, str]]:
+    projects = set()
+    for ref in pool.git.for_each_ref('--format=%(refname)', POOL_NAMESPACE).splitlines():
+        parts = ref.split('/')
+        if len(parts) > 4:
+            projects.add((unquote(parts[2]), unquote(parts[3])))
+    return projects
+
+def drop_namespaces(pool: Repo, projects: Iterable[Tuple[str, str]]):
+    refs = []
+    for owner, name in projects:
+        refs.extend(pool.git.for_each_ref('--format=%(refname)', pool_namespace(owner, name) + '/').splitlines())
+    if len(refs) > 0:
+        subprocess.run(['git', 'update-ref', '--stdin'], cwd=pool.git_dir, check=True,
+                       input=''.join(f'delete {ref}\n' for ref in refs), text=True)
+
+def prune_object_pool(data_root: Path, active: Set[Tuple[str, str]]) -> int:
+    # Drops the refs of projects which no longer live in `data_root'; objects
+    # only they used are removed by gc, once they are older than gc's
+    # prune expiry (so that clones being shared meanwhile aren't affected).
+    if not object_pool_path(data_root).exists():
+        return 0
+    pool = get_object_pool(data_root)
+    stale = pooled_projects(pool) - active
+    drop_namespaces(pool, stale)
+    if len(stale) > 0:
+        pool.git.gc('--quiet')
+    return len(stale)
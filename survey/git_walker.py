@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Streams the commit graph of a repository out of a single `git log --raw -z'
+# process, yielding one small record per commit instead of building GitPython
+# objects (and running a `git diff' per commit) for every commit.
+
+import os
+import subprocess
+from typing import Iterator, List, NamedTuple, Optional, Tuple, Union
+
+NULL_SHA = '0' * 40
+
+class FileChange(NamedTuple):
+    status: str
+    path: str
+    old_blob: Optional[str]
+    new_blob: Optional[str]
+    # The path before a rename (status `R').
+    old_path: Optional[str] = None
+
+class CommitRecord(NamedTuple):
+    sha: str
+    parents: Tuple[str, ...]
+    changes: Tuple[FileChange, ...]
+
+    @property
+    def is_merge(self) -> bool:
+        return len(self.parents) > 1
+
+    @property
+    def is_root(self) -> bool:
+        return len(self.parents) == 0
+
+    def modified_paths(self) -> List[str]:
+        # Added and deleted files have nothing to diff, unless the commit does
+        # both: renames are listed as an added and a deleted file, which the
+        # relevance check pairs again.
+        statuses = set(change.status for change in self.changes)
+        if 'A' in statuses and 'D' in statuses:
+            return [change.path for change in self.changes]
+        return [change.path for change in self.changes if change.status not in ('A', 'D')]
+
+def _tokens(stream, chunk_size: int = 1 << 16) -> Iterator[str]:
+    remainder = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        parts = (remainder + chunk).split(b'\0')
+        remainder = parts.pop()
+        for part in parts:
+            yield part.decode('utf-8', errors='surrogateescape')
+    if remainder:
+        yield remainder.decode('utf-8', errors='surrogateescape')
+
+def _blob(sha: str) -> Optional[str]:
+    return None if sha == NULL_SHA else sha
+
+def _change(token: str, tokens: Iterator[str]) -> FileChange:
+    # A raw diff entry: the modes, blobs and status, then the path, or both paths of a rename or copy.
+    _, _, old_blob, new_blob, status = token[1:].split(' ')
+    if status[0] in ('R', 'C'):
+        old_path = next(tokens)
+        return FileChange(status[0], next(tokens), _blob(old_blob), _blob(new_blob), old_path)
+    return FileChange(status[0], next(tokens), _blob(old_blob), _blob(new_blob))
+
+def walk_commits(repo_path: Union[str, os.PathLike], *revisions: str) -> Iterator[CommitRecord]:
+    # Merges and root commits are reported without changes, like `git log' does.
+    proc = subprocess.Popen(['git', 'log', '--raw', '-z', '--no-abbrev', '--no-renames',
+                             '--no-color', '--format=%H %P', *(revisions or ('HEAD',)), '--'],
+                            cwd=repo_path,
+                            stdout=subprocess.PIPE)
+    stdout = proc.stdout
+    if stdout is None:
+        raise ValueError("No output from git log.")
+    try:
+        header = None
+        changes: List[FileChange] = []
+        tokens = _tokens(stdout)
+        for token in tokens:
+            token = token.lstrip('\n')
+            if token.startswith(':'):
+                changes.append(_change(token, tokens))
+            elif token != '':
+                if header is not None:
+                    yield CommitRecord(header[0], tuple(header[1:]), tuple(changes))
+                header = token.split()
+                changes = []
+        if header is not None:
+            yield CommitRecord(header[0], tuple(header[1:]), tuple(changes))
+    finally:
+        stdout.close()
+        if proc.wait() not in (0, -13):
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+def commit_changes(repo_path: Union[str, os.PathLike], sha: str,
+                   paths: Optional[List[str]] = None, renames: bool = False) -> List[FileChange]:
+    # The files a commit changes against its parent, from `git diff-tree',
+    # which only compares trees and reads no file contents.  Finding renames
+    # reads the contents of added and deleted files (among `paths'), which a
+    # partial clone would fetch one at a time.
+    output = subprocess.run(['git', 'diff-tree', '-r', '-z', '--raw', '--root', '--no-abbrev',
+                             '-M' if renames else '--no-renames',
+                             '--no-commit-id', '--no-color', sha, '--', *(paths or [])],
+                            cwd=repo_path,
+                            stdout=subprocess.PIPE,
+                            check=True).stdout
+    changes = []
+    tokens = iter(output.decode('utf-8', errors='surrogateescape').split('\0'))
+    for token in tokens:
+        if token.startswith(':'):
+            changes.append(_change(token, tokens))
+    return changes
@@ -0,0 +1,143 @@
+// Long-running GumTree diff worker.
+//
+// Run with `java -cp 'GUMTREE_LIB_DIR/*' DiffServer.java`.  Requests are
+// read from stdin; each starts with a header line, and file contents are sent
+// as raw UTF-8 bytes directly after the header:
+//
+//   PING                                   -> PONG
+//   DIFF<TAB>generator<TAB>srclen<TAB>dstlen, then srclen + dstlen bytes
+//                                          -> OK <n> followed by n bytes of JSON,
+//                                             or ERR <message>
+//   BATCH<TAB>generator<TAB>count, then count times srclen<TAB>dstlen followed by
+//   the contents
+//                                          -> count DIFF replies, in order
+//
+// The JSON is the same as produced by `gumtree textdiff -f json`.
+
+import com.github.gumtreediff.actions.EditScript;
+import com.github.gumtreediff.actions.SimplifiedChawatheScriptGenerator;
+import com.github.gumtreediff.client.Run;
+import com.github.gumtreediff.gen.TreeGenerators;
+import com.github.gumtreediff.io.ActionsIoUtils;
+import com.github.gumtreediff.matchers.MappingStore;
+import com.github.gumtreediff.matchers.Matcher;
+import com.github.gumtreediff.matchers.Matchers;
+import com.github.gumtreediff.tree.TreeContext;
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.OutputStream;
+import java.io.StringWriter;
+import java.nio.charset.StandardCharsets;
+
+public class DiffServer {
+
+    private final DataInputStream in;
+    private final OutputStream out;
+
+    DiffServer(DataInputStream in, OutputStream out) {
+        this.in = in;
+        this.out = out;
+    }
+
+    private String readLine() throws Exception {
+        ByteArrayOutputStream line = new ByteArrayOutputStream();
+        int c;
+        while ((c = in.read()) != '\n') {
+            if (c == -1) {
+                return line.size() == 0 ? null : line.toString(StandardCharsets.UTF_8);
+            }
+            line.write(c);
+        }
+        return line.toString(StandardCharsets.UTF_8);
+    }
+
+    private String readContent(int length) throws Exception {
+        byte[] content = new byte[length];
+        in.readFully(content);
+        return new String(content, StandardCharsets.UTF_8);
+    }
+
+    private void reply(String header, byte[] payload) throws Exception {
+        out.write((header + "\n").getBytes(StandardCharsets.UTF_8));
+        if (payload != null) {
+            out.write(payload);
+        }
+        out.flush();
+    }
+
+    private void error(Throwable ex) throws Exception {
+        String message = ex.getClass().getSimpleName() + ": " + ex.getMessage();
+        reply("ERR " + message.replaceAll("[\r\n]+", " "), null);
+    }
+
+    private byte[] diff(String generator, String src, String dst) throws Exception {
+        TreeContext srcTree = TreeGenerators.getInstance().get(generator).generateFrom().string(src);
+        TreeContext dstTree = TreeGenerators.getInstance().get(generator).generateFrom().string(dst);
+        Matcher matcher = Matchers.getInstance().getMatcher();
+        MappingStore mappings = matcher.match(srcTree.getRoot(), dstTree.getRoot());
+        EditScript actions = new SimplifiedChawatheScriptGenerator().computeActions(mappings);
+        StringWriter writer = new StringWriter();
+        ActionsIoUtils.toJson(srcTree, actions, mappings).writeTo(writer);
+        return writer.toString().getBytes(StandardCharsets.UTF_8);
+    }
+
+    private void replyDiff(String generator, String src, String dst) throws Exception {
+        try {
+            byte[] result = diff(generator, src, dst);
+            reply("OK " + result.length, result);
+        } catch (Exception | StackOverflowError ex) {
+            error(ex);
+        }
+    }
+
+    private void batch(String generator, int count) throws Exception {
+        // Read the whole batch first so the client never blocks writing while we reply.
+        String[][] pairs = new String[count][];
+        for (int i = 0; i < count; i++) {
+            String[] lengths = readLine().split("\t");
+            pairs[i] = new String[] { readContent(Integer.parseInt(lengths[0])),
+                                      readContent(Integer.parseInt(lengths[1])) };
+        }
+        for (String[] pair : pairs) {
+            replyDiff(generator, pair[0], pair[1]);
+        }
+    }
+
+    void serve() throws Exception {
+        String line;
+        while ((line = readLine()) != null) {
+            String[] request = line.split("\t");
+            switch (request[0]) {
+                case "PING":
+                    reply("PONG", null);
+                    break;
+                case "DIFF":
+                    String src = readContent(Integer.parseInt(request[2]));
+                    String dst = readContent(Integer.parseInt(request[3]));
+                    replyDiff(request[1], src, dst);
+                    break;
+                case "BATCH":
+                    batch(request[1], Integer.parseInt(request[2]));
+                    break;
+                default:
+                    reply("ERR Unknown request " + request[0], null);
+            }
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        // Anything GumTree or the parsers print must not end up in the reply stream.
+        OutputStream out = new BufferedOutputStream(new FileOutputStream(FileDescriptor.out));
+        System.setOut(System.err);
+
+        Run.initGenerators();
+
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+        new DiffServer(in, out).serve();
+    }
+}
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import logging
+import os
+import selectors
+import subprocess
+import time
+from pathlib import Path
+from typing import IO, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+SERVER_SOURCE = Path(__file__).parent / 'gumtree' / 'DiffServer.java'
+
+class GumTreeServerError(Exception):
+    pass
+
+class GumTreeServerStartError(GumTreeServerError):
+    # The server can't be started at all, e.g. without a Java compiler or GumTree's jars.
+    pass
+
+class GumTreeServer:
+
+    def __init__(self, lib_dir: str, env: dict,
+                 timeout: float = 300,
+                 health_check_interval: float = 60):
+        self.lib_dir = lib_dir
+        self.env = env
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._proc: Optional[subprocess.Popen[bytes]] = None
+        self._buffer = b''
+        self._last_used = 0.0
+
+    @property
+    def command(self) -> List[str]:
+        return ['java', '-cp', str(Path(self.lib_dir) / '*'), str(SERVER_SOURCE)]
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self):
+        self.stop()
+        try:
+            self._proc = subprocess.Popen(self.command,
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL,
+                                          env=self.env)
+        except OSError as ex:
+            raise GumTreeServerStartError("Unable to start GumTree server.", ex)
+        self._buffer = b''
+        # The first request also covers compiling the server source and loading GumTree.
+        if not self.ping(timeout=max(self.timeout, 120)):
+            self.stop()
+            raise GumTreeServerStartError("GumTree server did not respond after starting.")
+
+    def stop(self):
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+                self._proc.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self._proc.kill()
+                self._proc.wait()
+            self._proc = None
+
+    def restart(self):
+        logger.warning("Restarting GumTree server.")
+        self.start()
+
+    def _pipes(self) -> Tuple[IO[bytes], IO[bytes]]:
+        if self._proc is None or self._proc.stdin is None or self._proc.stdout is None:
+            raise GumTreeServerError("GumTree server is not running.")
+        return self._proc.stdin, self._proc.stdout
+
+    def _send(self, request: str, *contents: bytes):
+        stdin, _ = self._pipes()
+        try:
+            stdin.write(request.encode() + b'\n')
+            for content in contents:
+                stdin.write(content)
+            stdin.flush()
+        except (OSError, ValueError) as ex:
+            self.stop()
+            raise GumTreeServerError("GumTree server connection lost.", ex)
+
+    def _fill(self, deadline: float):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("GumTree server did not respond in time.")
+        _, stdout = self._pipes()
+        with selectors.DefaultSelector() as selector:
+            selector.register(stdout, selectors.EVENT_READ)
+            if len(selector.select(remaining)) == 0:
+                raise TimeoutError("GumTree server did not respond in time.")
+        data = os.read(stdout.fileno(), 1 << 16)
+        if len(data) == 0:
+            raise GumTreeServerError("GumTree server exited unexpectedly.")
+        self._buffer += data
+
+    def _read_line(self, deadline: float) -> str:
+        while b'\n' not in self._buffer:
+            self._fill(deadline)
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.decode()
+
+    def _read_exact(self, size: int, deadline: float) -> bytes:
+        while len(self._buffer) < size:
+            self._fill(deadline)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _request(self, request: str, *contents: bytes, timeout: Optional[float] = None) -> bytes:
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._send(request, *contents)
+        return self._read_reply(deadline)
+
+    def _read_reply(self, deadline: float) -> bytes:
+        try:
+            header = self._read_line(deadline)
+            if header == 'PONG':
+                return b''
+            if header.startswith('OK '):
+                return self._read_exact(int(header[3:]), deadline)
+        except (TimeoutError, GumTreeServerError):
+            # The server is in an unknown state, don't reuse it.
+            self.stop()
+            raise
+        finally:
+            self._last_used = time.monotonic()
+        if header.startswith('ERR '):
+            raise ValueError("AST Diff Generation Failed.", header[4:])
+        self.stop()
+        raise GumTreeServerError("Unexpected response from GumTree server.", header)
+
+    def ping(self, timeout: float = 10) -> bool:
+        try:
+            self._request('PING', timeout=timeout)
+            return True
+        except (TimeoutError, GumTreeServerError):
+            return False
+
+    def ensure_running(self):
+        if not self.alive:
+            self.start()
+        elif time.monotonic() - self._last_used > self.health_check_interval and not self.ping():
+            self.restart()
+
+    def diff(self, generator: str, a_data: bytes, b_data: bytes, timeout: Optional[float] = None) -> str:
+        request = f'DIFF\t{generator}\t{len(a_data)}\t{len(b_data)}'
+        self.ensure_running()
+        try:
+            return self._request(request, a_data, b_data, timeout=timeout).decode()
+        except GumTreeServerError:
+            # A crashed server gets one fresh start before giving up on the pair.
+            self.restart()
+            return self._request(request, a_data, b_data, timeout=timeout).decode()
+
+    def diff_batch(self, generator: str, pairs: List[Tuple[bytes, bytes]],
+                   timeout: Optional[float] = None) -> List[Union[str, Exception]]:
+        contents = []
+        for a_data, b_data in pairs:
+            contents.extend([f'{len(a_data)}\t{len(b_data)}\n'.encode(), a_data, b_data])
+        self.ensure_running()
+        deadline = time.monotonic() + (timeout or self.timeout) * max(len(pairs), 1)
+        results: List[Union[str, Exception]] = []
+        self._send(f'BATCH\t{generator}\t{len(pairs)}', *contents)
+        for _ in pairs:
+            try:
+                results.append(self._read_reply(deadline).decode())
+            except ValueError as ex:
+                results.append(ex)
+            except (TimeoutError, GumTreeServerError) as ex:
+                # The server has been stopped, the rest of the batch is lost with it.
+                results.extend([ex] * (len(pairs) - len(results)))
+                break
+        return results
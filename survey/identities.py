@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Maps git author/committer email addresses to GitHub logins.  Addresses are
+# resolved, in order, from GitHub noreply addresses, the persisted
+# CommitterIdentity table, and finally batched GraphQL queries for the
+# commits the unknown addresses were seen on.  Addresses GitHub doesn't know
+# are stored without a login so they are not looked up again.
+
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .models import CommitterIdentity, Project
+
+noreply_re = re.compile(r'^(?:\d+\+)?([a-z0-9](?:[a-z0-9-]*[a-z0-9])?)@users\.noreply\.github\.com$', re.IGNORECASE)
+
+# Commits made through the web interface are committed by `web-flow'.
+WEB_FLOW_EMAIL = 'noreply@github.com'
+WEB_FLOW_LOGIN = 'web-flow'
+
+GRAPHQL_BATCH_SIZE = 50
+
+def graphql_query(project: Project, query: str, variables: dict) -> dict:
+    # PyGithub has no public GraphQL interface, this is the only use of its private one.
+    _, data = project.gh._requester.graphql_query(query, variables)
+    return data
+
+def noreply_login(email: str) -> Optional[str]:
+    # Expects the address as written, logins keep their case.
+    if email.lower() == WEB_FLOW_EMAIL:
+        return WEB_FLOW_LOGIN
+    match = noreply_re.match(email)
+    if match is not None:
+        return match.group(1)
+    return None
+
+def record_identity(email: Optional[str], login: Optional[str]):
+    if email and login:
+        CommitterIdentity.objects.update_or_create(email=email.lower(), defaults={'login': login})
+
+def record_raw_commit(raw_data: dict):
+    # Keep the logins from a REST commit object which was fetched anyway.
+    for role in ('author', 'committer'):
+        user = raw_data.get(role)
+        person = (raw_data.get('commit') or {}).get(role)
+        if user and person:
+            record_identity(person.get('email'), user.get('login'))
+
+class IdentityResolver:
+
+    def __init__(self, project: Project):
+        self.project = project
+        self.known: Dict[str, Optional[str]] = {}
+
+    def query_commits(self, shas: List[str]) -> Dict[str, Optional[str]]:
+        fields = '\n'.join(f'c{i}: object(oid: "{sha}") {{ ... on Commit {{ '
+                           'author { email user { login } } committer { email user { login } } }}'
+                           for i, sha in enumerate(shas))
+        query = f'query($owner: String!, $name: String!) {{ repository(owner: $owner, name: $name) {{ {fields} }} }}'
+        data = graphql_query(self.project, query, {'owner': self.project.owner, 'name': self.project.name})
+
+        found = {}
+        for commit in data['data']['repository'].values():
+            if commit is None:
+                continue
+            for role in ('author', 'committer'):
+                person = commit.get(role) or {}
+                if person.get('email'):
+                    found[person['email'].lower()] = (person.get('user') or {}).get('login')
+        return found
+
+    def resolve(self, people: Iterable[Tuple[str, str]]) -> Dict[str, Optional[str]]:
+        # Takes (email, commit sha) pairs, returns logins keyed by lower-case email.
+        unknown: Dict[str, str] = {}
+        for address, sha in people:
+            email = address.lower()
+            if email in self.known or email in unknown:
+                continue
+            login = noreply_login(address)
+            if login is not None:
+                self.known[email] = login
+            else:
+                unknown[email] = sha
+
+        if len(unknown) > 0:
+            for identity in CommitterIdentity.objects.filter(email__in=list(unknown.keys())):
+                self.known[identity.email] = identity.login
+                del unknown[identity.email]
+
+        if len(unknown) > 0:
+            shas = list(dict.fromkeys(unknown.values()))
+            found = {}
+            for i in range(0, len(shas), GRAPHQL_BATCH_SIZE):
+                found.update(self.query_commits(shas[i:i + GRAPHQL_BATCH_SIZE]))
+            CommitterIdentity.objects.bulk_create([CommitterIdentity(email=email, login=found.get(email))
+                                                   for email in unknown.keys()],
+                                                  ignore_conflicts=True)
+            for email in unknown.keys():
+                self.known[email] = found.get(email)
+
+        return self.known
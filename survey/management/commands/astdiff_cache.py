@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.ast_diff import get_diff_cache
+
+class Command(BaseCommand):
+    help = "Show (or clear) the AST diff cache of this node."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear',
+                            help='Remove all cached diffs and reset counters.',
+                            default=False,
+                            action='store_true')
+
+    def handle(self, *args, clear=False, **options):
+        cache = get_diff_cache()
+        if cache is None:
+            raise CommandError('The AST diff cache is disabled (AST_DIFF_CACHE is empty).')
+
+        if clear:
+            cache.clear()
+            print(f'Cleared {cache.path}.')
+            return
+
+        stats = cache.stats()
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        print(f'Cache at {cache.path}:')
+        print(f'  {stats["entries"]} entries, {stats["size"] / (1024 * 1024):.1f} of {cache.max_size / (1024 * 1024):.0f} MiB used')
+        print(f'  {stats["failures"]} blob pairs failed to diff')
+        for name, value in sorted(stats.items()):
+            if name not in ('entries', 'size', 'failures'):
+                print(f'  {name}: {value}')
+        if lookups > 0:
+            print(f'  hit rate: {100 * stats.get("hits", 0) / lookups:.1f}%')
+        prefiltered = stats.get('prefilter_skipped', 0) + stats.get('prefilter_passed', 0)
+        if prefiltered > 0:
+            print(f'  AST diffs avoided by pre-filter: {100 * stats.get("prefilter_skipped", 0) / prefiltered:.1f}%')
+        for name, diffed in sorted(stats.items()):
+            if name.startswith('diffed_') and diffed > 0:
+                language = name[len('diffed_'):]
+                failed = sum(value for failure, value in stats.items() if failure.startswith(f'failed_{language}_'))
+                print(f'  failure rate ({language}): {100 * failed / diffed:.1f}%')
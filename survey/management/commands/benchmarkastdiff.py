@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from django.core.management.base import BaseCommand
+
+import random
+import time
+
+from survey.ast_diff import TypeTreeIndex, Match, Node
+
+NODE_TYPES = ['identifier', 'call', 'argument_list', 'block', 'type', 'typed_parameter', 'type_annotation']
+
+def locate_type_tree_linear(matches, start: int, end: int) -> bool:
+    for match in matches:
+        if match.src.is_type and match.src.start <= start and end <= match.src.end:
+            return True
+    return False
+
+class Command(BaseCommand):
+    help = "Benchmark type-tree lookup (linear scan vs. interval index) on synthetic large diffs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches',
+                            help='Number of matches per diff (may be given more than once)',
+                            type=int,
+                            action='append')
+        parser.add_argument('--actions',
+                            help='Number of actions per diff',
+                            type=int,
+                            default=2000)
+        parser.add_argument('--seed',
+                            type=int,
+                            default=0)
+
+    def generate_diff(self, rng: random.Random, num_matches: int, num_actions: int):
+        file_size = num_matches * 20
+        matches = []
+        for _ in range(num_matches):
+            start = rng.randrange(file_size)
+            end = start + rng.randrange(1, 200)
+            node_type = rng.choice(NODE_TYPES)
+            matches.append(Match(Node(node_type, start, end), Node(node_type, start, end)))
+        queries = []
+        for _ in range(num_actions):
+            start = rng.randrange(file_size)
+            queries.append((start, start + rng.randrange(1, 50)))
+        return matches, queries
+
+    def handle(self, *args, matches=None, actions=2000, seed=0, **options):
+        rng = random.Random(seed)
+        print(f'{"matches":>8} {"actions":>8} {"linear (s)":>11} {"indexed (s)":>12} {"speedup":>8}')
+        for num_matches in (matches or [1000, 5000, 20000]):
+            diff_matches, queries = self.generate_diff(rng, num_matches, actions)
+
+            start_time = time.perf_counter()
+            linear = [locate_type_tree_linear(diff_matches, start, end) for start, end in queries]
+            linear_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            index = TypeTreeIndex.from_matches(diff_matches)
+            indexed = [index.contains(start, end) for start, end in queries]
+            indexed_time = time.perf_counter() - start_time
+
+            assert linear == indexed, 'Index and linear scan disagree.'
+            print(f'{num_matches:>8} {actions:>8} {linear_time:>11.3f} {indexed_time:>12.4f} {linear_time / indexed_time:>7.0f}x')
@@ -1,54 +1,92 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import logging
+
 from django.core.management.base import BaseCommand
-from git import Repo
-from git.objects.commit import Commit as git_commit
+from django.db.models import Count
 from socket import gethostname
-from survey.models import Commit, MetricsCommit, Project
-from survey.tasks.commits import change_type_to_relevance_type
-from survey.utils import check_commit_is_relevant
+from survey.models import MetricsJob, Project
+from survey.metrics import MetricsCollector, METRICS_BATCH_SIZE, logger, needs_reevaluation, restart_collection
+from survey.tasks.metrics import start_metrics_collection
 
 
 class Command(BaseCommand):
     help = "Collect metrics for projects in the survey"
 
-    def handle(self, *args, **options):
-        for project in Project.objects.filter(track_changes=True, installation_id__isnull=False, metrics_collected=False):
-            if project.host_node and project.host_node.hostname == gethostname():
-                self.collect_metrics(project)
-                project.metrics_collected = True
-                project.save()
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+                            help='Number of worker processes (default: one per core)',
+                            type=int,
+                            default=None)
+        parser.add_argument('--batch-size',
+                            help='Number of commits processed between checkpoints',
+                            type=int,
+                            default=METRICS_BATCH_SIZE)
+        parser.add_argument('--incremental',
+                            help='Only process commits made since the last collection of already collected projects',
+                            default=False,
+                            action='store_true')
+        parser.add_argument('--reevaluate',
+                            help='Collect again the projects with results from an older version of the relevance check; only those commits are checked again',
+                            default=False,
+                            action='store_true')
+        parser.add_argument('--distribute',
+                            help='Queue a metrics job for every project on its host node instead of collecting locally',
+                            default=False,
+                            action='store_true')
+        parser.add_argument('--status',
+                            help='Show the status of distributed metrics jobs',
+                            default=False,
+                            action='store_true')
+
+    def handle(self, *args, workers=None, batch_size=METRICS_BATCH_SIZE, incremental=False, reevaluate=False, distribute=False, status=False, **options):
+        if status:
+            self.show_status()
+            return
+
+        if reevaluate:
+            collected = Project.objects.filter(track_changes=True, installation_id__isnull=False, metrics_collected=True)
+            if not distribute:
+                collected = collected.filter(host_node__hostname=gethostname())
+            for project in collected:
+                if needs_reevaluation(project):
+                    print(f'Re-evaluating {project}.')
+                    restart_collection(project)
+
+        if distribute:
+            start_metrics_collection.delay(incremental)
+            print('Queued metrics collection on all nodes; use --status to follow it.')
+            return
+
+        projects = [project for project in Project.objects.filter(track_changes=True, installation_id__isnull=False, metrics_collected=incremental)
+                    if project.host_node and project.host_node.hostname == gethostname()]
+        if len(projects) == 0:
+            return
+
+        # The collector logs its progress; every commit is shown with `-v 2'.
+        handler = logging.StreamHandler(self.stdout)
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG if options['verbosity'] > 1 else logging.INFO)
+
+        with MetricsCollector(workers, batch_size) as collector:
+            for project in projects:
+                self.collect_metrics(collector, project)
 
-    def collect_metrics(self, project):
+    def collect_metrics(self, collector: MetricsCollector, project: Project):
         print(f'Collecting metrics for {project}...')
         try:
-            repo = Repo(project.path)
-            for commit in repo.iter_commits():
-                if len(commit.parents):
-                    self.process_commit(project, repo, commit)
+            relevant = collector.collect(project)
+            print(f'  Found {relevant} relevant commits.')
         except KeyboardInterrupt as ex:
             raise ex
         except:
             print(f'Failed to open repository at {project.path}.')
 
-    def process_commit(self, project: Project, repo: Repo, raw_commit: git_commit):
-        commit = Commit(project=project,
-                        hash=raw_commit.hexsha,
-                        message="",
-                        diff=repo.git.diff(raw_commit),)
-
-        commit_is_relevant = check_commit_is_relevant(repo, commit)
-        if commit_is_relevant is not None:
-            metric = MetricsCommit()
-            relevant_file, relevant_line, change_type = commit_is_relevant[0]
-            metric.project = project
-            metric.hash = commit.hash
-            metric.relevance_type = change_type_to_relevance_type(change_type)
-            metric.relevant_change_file = relevant_file
-            metric.relevant_change_line = relevant_line
-            metric.created_at = raw_commit.committed_datetime
-            metric.author = commit.gh.author.login
-            metric.committer = commit.gh.committer.login
-            metric.save()
-            print(f'  -> Processed commit {metric.hash} with relevance type {metric.relevance_type} in file {metric.relevant_change_file} at line {metric.relevant_change_line}.')
+    def show_status(self):
+        jobs = MetricsJob.objects.values_list('node__hostname', 'status').annotate(count=Count('id')).order_by('node__hostname', 'status')
+        labels = dict(MetricsJob.JobStatus.choices)
+        for hostname, job_status, count in jobs:
+            print(f'{hostname:<30} {labels[job_status]:<8} {count:>6}')
+        for job in MetricsJob.objects.filter(status=MetricsJob.JobStatus.RUNNING).select_related('project'):
+            print(f'  {job.project}: {job.processed_commits} commits checked, {job.relevant_commits} relevant')
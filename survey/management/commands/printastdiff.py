@@ -8,7 +8,7 @@ import json
 
 from typing import Optional, Tuple, List
 
-from survey.ast_diff import AstDiff
+from survey.ast_diff import AstDiff, ENGINES
 from survey.utils import is_diff_relevant
 from pathlib import Path
 
@@ -26,6 +26,9 @@ class Command(BaseCommand):
                             type=str)
         parser.add_argument('--test',
                             type=str)
+        parser.add_argument('--engine',
+                            help='Diff engine to use (tree-sitter falls back to gumtree for unsupported languages)',
+                            choices=ENGINES)
         pass
 
     def generate_test_list(self, language: Optional[str], test: Optional[str]) -> List[Tuple[str, str]]:
@@ -74,17 +77,17 @@ class Command(BaseCommand):
             print()
 
             print(f"## Removing Annotation at location:")
-            diff_remove = AstDiff(with_annot, without_annot, lang)
+            diff_remove = AstDiff(with_annot, without_annot, lang, options['engine'])
             print('```json')
-            print(json.dumps(diff_remove.actions, indent=4))
+            print(json.dumps([action.as_dict() for action in diff_remove.actions], indent=4))
             print('```')
             print(is_diff_relevant(diff_remove) or 'NONE')
             print()
 
             print(f"## Adding Annotation at location:")
-            diff_add = AstDiff(without_annot, with_annot, lang)
+            diff_add = AstDiff(without_annot, with_annot, lang, options['engine'])
             print('```json')
-            print(json.dumps(diff_add.actions, indent=4))
+            print(json.dumps([action.as_dict() for action in diff_add.actions], indent=4))
             print('```')
             print(is_diff_relevant(diff_add) or 'NONE')
             print()
@@ -8,6 +8,7 @@ from pathlib import Path
 import pandas as pd
 
 from survey.models import Project, Node, DeletedRepository
+from survey.placement import expected_size, has_room, node_loads, placeable_nodes, project_costs, tracked_projects
 
 from survey.tasks import clone_repo
 
@@ -21,91 +22,126 @@ class Command(BaseCommand):
                             action='store_true')
 
         parser.add_argument('--data-file',
-                            help='Path to CSV file describing a given state.  Needs host, project_count, and enabled columns.  Only possible with `--dry-run\'.',
+                            help='Path to CSV file describing a given state.  Needs host, project_count, and enabled columns, and optionally load (defaults to project_count).  Only possible with `--dry-run\'.',
                             type=Path)
     def calculate_balance_table(self, df):
         df = df.copy()
 
         nodes = df.enabled.sum()
         projects = df.project_count.sum()
+        load = df.load.sum()
 
-        target = projects // nodes + (1 if (projects % nodes) != 0 else 0)
+        # Projects are weighed by their cost (see survey.placement), an average project costs about 1.
+        target = load / nodes
 
-        df['move_count'] = df.project_count - target
+        df['excess_load'] = df.load - target
 
-        df.loc[~df.enabled, 'move_count'] = df.loc[~df.enabled, 'project_count']
+        df.loc[~df.enabled, 'excess_load'] = df.loc[~df.enabled, 'load']
 
-        df['off_balance'] = df.move_count.div(target).mul(100).convert_dtypes()
-        df = df.sort_values(['move_count', 'enabled', 'project_count'], ascending=[False, True, False])
+        df['off_balance'] = df.excess_load.div(target).mul(100).round(1)
+        df = df.sort_values(['excess_load', 'enabled', 'load'], ascending=[False, True, False])
 
         mean_misbalance = df.off_balance.mean()
 
-        movable_projects = df.loc[df.move_count > 0].move_count.sum()
-        available_slots = df.loc[df.move_count < 0].move_count.sum() * -1
+        excess_load = df.loc[df.excess_load > 0].excess_load.sum()
+        available_load = 0 - df.loc[df.excess_load < 0].excess_load.sum()
 
-        return df, nodes, projects, target, mean_misbalance, movable_projects, available_slots
+        return df, nodes, projects, target, mean_misbalance, excess_load, available_load
+
+    def collect_movable(self, node, projects, costs, excess):
+        # The most expensive projects which fit in the node's excess load; everything on disabled nodes.
+        movable = []
+        for prj in sorted(projects, key=lambda prj: costs[prj.id], reverse=True):
+            if not node.enabled or costs[prj.id] <= excess:
+                movable.append(prj)
+                excess -= costs[prj.id]
+        return movable
 
     def handle(self, *args, **options):
         if options['dry_run'] and options['data_file']:
-            state_table = pd.read_csv(options['data_file'])[['host', 'project_count', 'enabled']]
+            state_table = pd.read_csv(options['data_file'])
+            if 'load' not in state_table.columns:
+                state_table['load'] = state_table.project_count
+            state_table = state_table[['host', 'project_count', 'load', 'enabled']]
         else:
+            projects = tracked_projects()
+            costs = project_costs(projects)
+            loads = node_loads(projects, costs)
+            placeable = placeable_nodes()
             node_data = []
             for node in Node.objects.all():
-                node_data.append({'host': node.hostname, 'project_count': node.project_set.count(), 'enabled': node.enabled})
+                # Hosts without a worker (like the web server) register nodes too.
+                if node not in placeable and node.project_set.count() == 0:
+                    continue
+                node_data.append({'host': node.hostname,
+                                  'project_count': node.project_set.count(),
+                                  'load': round(loads.get(node.id, 0), 2),
+                                  'disk_free': node.disk_free,
+                                  'enabled': node.enabled})
             state_table = pd.DataFrame(node_data)
 
-        balance_table, nodes, projects, target, mean_off_balance, excess, available = self.calculate_balance_table(state_table)
+        balance_table, nodes, projects_count, target, mean_off_balance, excess, available = self.calculate_balance_table(state_table)
         print('Current State:')
         print(balance_table.to_string(index=False))
         print()
-        print(f'There are {nodes} nodes, with {projects} total projects.')
-        print(f'Each node should have about {target} projects on it.')
+        print(f'There are {nodes} nodes, with {projects_count} total projects.')
+        print(f'Each node should have a load of about {target:.2f}.')
         print()
-        print(f'There are {excess} excess projects, and {available} available slots.')
+        print(f'There is an excess load of {excess:.2f}, and {available:.2f} available.')
 
         if excess == 0:
-            print('Since no excess projects are available, no action will be taken.')
+            print('Since no excess load is available, no action will be taken.')
             return 0
-        elif excess == available:
-            print("Nodes should be balanced at the end.")
-        else:
-            print("Nodes will be nearly balanced.")
 
         if options['dry_run'] and options['data_file']:
             return 0
 
         print()
 
-        movable_data = balance_table.loc[balance_table.move_count > 0]
-        available_data = balance_table.loc[balance_table.move_count < 0].sort_values(by='move_count')
+        movable_data = balance_table.loc[balance_table.excess_load > 0]
 
         movable_repositories = []
 
         for i, row in movable_data.iterrows():
             node = Node.objects.get(hostname=row.host)
-            for prj in Project.objects.filter(host_node=node).order_by('add_date')[:row.move_count]:
-                print(f'Collecting {prj} from {node}.')
+            node_projects = [prj for prj in projects if prj.host_node_id == node.id]
+            for prj in self.collect_movable(node, node_projects, costs, row.excess_load):
+                print(f'Collecting {prj} from {node} (cost {costs[prj.id]:.2f}).')
                 movable_repositories.append(prj)
 
         print()
 
-        for i, row in available_data.iterrows():
-            new_node = Node.objects.get(hostname=row.host)
-            needed = -row.move_count
-            remaining = min(needed, len(movable_repositories))
-            projects_to_move = movable_repositories[:remaining]
-            for prj in projects_to_move:
-                deletion_record = DeletedRepository(node=prj.host_node, owner=prj.owner, name=prj.name, reason=DeletedRepository.DeletionReason.REBALANCE)
-                if prj.data_subdir is not None:
-                    deletion_record.subdir = prj.data_subdir
-                print(f'Created deletion record for {prj} on {prj.host_node}.')
-                if not options['dry_run']:
-                    deletion_record.save()
-                prj.host_node = new_node
-                print(f'Changed {prj} node to {new_node}')
-                if not options['dry_run']:
-                    prj.data_subdir = None
-                    prj.save()
-                print(f'Fetching {prj} on {new_node}')
-                if not options['dry_run']:
-                    clone_repo.apply_async([prj.id], queue=new_node.hostname)
+        # Each project goes to the least loaded placeable node with room for it,
+        # as long as that leaves the load more even than before.
+        disk_free = {node.id: node.disk_free for node in placeable}
+        for prj in sorted(movable_repositories, key=lambda prj: costs[prj.id], reverse=True):
+            size = expected_size(prj)
+            candidates = [node for node in placeable
+                          if node.id != prj.host_node_id and has_room(disk_free[node.id], size)]
+            new_node = min(candidates, key=lambda node: (loads.get(node.id, 0), node.hostname), default=None)
+            if new_node is None:
+                print(f'No node has room for {prj}, leaving it on {prj.host_node}.')
+                continue
+            if prj.host_node.enabled and loads.get(new_node.id, 0) + costs[prj.id] >= loads.get(prj.host_node_id, 0):
+                print(f'Moving {prj} would not improve the balance, leaving it on {prj.host_node}.')
+                continue
+
+            loads[prj.host_node_id] = loads.get(prj.host_node_id, 0) - costs[prj.id]
+            loads[new_node.id] = loads.get(new_node.id, 0) + costs[prj.id]
+            if disk_free[new_node.id] is not None:
+                disk_free[new_node.id] -= size
+
+            deletion_record = DeletedRepository(node=prj.host_node, owner=prj.owner, name=prj.name, reason=DeletedRepository.DeletionReason.REBALANCE)
+            if prj.data_subdir is not None:
+                deletion_record.subdir = prj.data_subdir
+            print(f'Created deletion record for {prj} on {prj.host_node}.')
+            if not options['dry_run']:
+                deletion_record.save()
+            prj.host_node = new_node
+            print(f'Changed {prj} node to {new_node}')
+            if not options['dry_run']:
+                prj.data_subdir = None
+                prj.save()
+            print(f'Fetching {prj} on {new_node}')
+            if not options['dry_run']:
+                clone_repo.apply_async([prj.id], queue=new_node.hostname)
@@ -4,7 +4,7 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Count, Q
 
-from survey.models import Project, Committer, Commit, Response, MetricsCommit
+from survey.models import Project, Committer, Commit, Response, MetricsCommit, RelevanceResult, RelevantChange
 
 import pandas as pd
 from scipy.stats import pearsonr
@@ -70,7 +70,7 @@ class Command(BaseCommand):
 
         df_commit_data = pd.DataFrame([{ 'project': str(cmt.project),
                                          'hash': str(cmt.hash),
-                                         'author': str(cmt.author),
+                                         'author': cmt.author,
                                          'relevance_type': str(cmt.relevance_type) }
                                        for cmt in MetricsCommit.objects.all()])
 
@@ -84,6 +84,25 @@ class Command(BaseCommand):
         print(num_changes)
         save_table(num_changes, 'number_relevant_changes.tex')
 
+        # Counted in the database, over every relevant change of a commit rather than the first one.
+        df_change_data = pd.DataFrame(RelevantChange.objects.filter(result__outcome=RelevanceResult.Outcome.RELEVANT)
+                                                            .values('result__project', 'change_type', 'node_kind')
+                                                            .annotate(count=Count('id')))
+        if len(df_change_data) > 0:
+            print()
+            print('Number of relevant changes (all changes per commit):')
+            num_all_changes = df_change_data.groupby(['result__project', 'change_type'])['count'].sum() \
+                                            .groupby('change_type').describe()
+            print(num_all_changes)
+            save_table(num_all_changes, 'number_relevant_changes_all.tex')
+
+            print()
+            print('Relevant changes by AST node kind:')
+            changes_by_kind = df_change_data.groupby(['node_kind', 'change_type'])['count'].sum() \
+                                            .unstack(fill_value=0)
+            print(changes_by_kind)
+            save_table(changes_by_kind, 'relevant_changes_node_kinds.tex')
+
 
         df_num_commits = pd.DataFrame([{ 'project': str(prj),
                                          'num_commits': prj.num_commits,
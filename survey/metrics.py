@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Historical metrics collection.  Relevance checks only need the local clone,
+# so commits are spread over a pool of worker processes.  Results come back in
+# commit order and are written in batches together with a checkpoint, from
+# which an interrupted collection resumes.
+
+import logging
+import multiprocessing
+import multiprocessing.pool
+import os
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from decouple import config
+from django.db import connections, transaction
+from django.utils import timezone
+from git import Repo
+from git.exc import BadName
+
+from .identities import IdentityResolver
+from .models import MetricsCheckpoint, MetricsCommit, Project, RelevanceResult, RelevantChange
+from .git_walker import CommitRecord, walk_commits
+from .utils import DetectedChange, change_type_to_relevance_type, check_revision_is_relevant, detector_version, file_is_relevant
+
+logger = logging.getLogger(__name__)
+
+METRICS_WORKERS = config('METRICS_WORKERS', default=0, cast=int)
+METRICS_BATCH_SIZE = config('METRICS_BATCH_SIZE', default=500, cast=int)
+
+_repos: Dict[str, Repo] = {}
+
+def check_revision(job: Tuple[str, str, str, Optional[List[str]]]):
+    # Runs in the worker processes, which never touch the database.  Returns
+    # whether the detector ran at all, its result and the error, if any.
+    path, language, sha, changed_files = job
+    if changed_files is not None and len(changed_files) == 0:
+        return sha, False, None, None
+    try:
+        if path not in _repos:
+            _repos[path] = Repo(path)
+        return sha, True, check_revision_is_relevant(_repos[path], language, sha, changed_files), None
+    except Exception as ex:
+        return sha, True, None, repr(ex)
+
+def tip(repo: Repo) -> str:
+    # Fetches only move the remote-tracking refs, not the clone's own HEAD.
+    try:
+        return repo.commit('origin/HEAD').hexsha
+    except (BadName, ValueError):
+        return repo.head.commit.hexsha
+
+def is_known(repo: Repo, sha: Optional[str]) -> bool:
+    try:
+        return sha is not None and repo.commit(sha) is not None
+    except (BadName, ValueError):
+        return False
+
+def get_checkpoint(project: Project, repo: Repo) -> MetricsCheckpoint:
+    checkpoint: MetricsCheckpoint
+    checkpoint, created = MetricsCheckpoint.objects.get_or_create(project=project,
+                                                                  defaults={'ref': tip(repo)})
+    if created:
+        return checkpoint
+
+    if not is_known(repo, checkpoint.ref):
+        # History was rewritten since the collection started, start over.
+        checkpoint.ref = tip(repo)
+        checkpoint.base = None
+        checkpoint.hash = None
+        checkpoint.complete = False
+        checkpoint.save()
+    elif checkpoint.complete and checkpoint.ref != tip(repo):
+        # Everything up to the high-water mark is done, continue with the new commits.
+        checkpoint.base = checkpoint.ref
+        checkpoint.ref = tip(repo)
+        checkpoint.hash = None
+        checkpoint.complete = False
+        checkpoint.save()
+    if checkpoint.base is not None and not is_known(repo, checkpoint.base):
+        checkpoint.base = None
+        checkpoint.save()
+    return checkpoint
+
+def save_changes(project: Project, changes: Dict[str, List[DetectedChange]]):
+    # Replaces the stored changes of the given commits with a single bulk insert.
+    result_ids = dict(RelevanceResult.objects.filter(project=project, hash__in=list(changes.keys()))
+                      .values_list('hash', 'id'))
+    RelevantChange.objects.filter(result_id__in=list(result_ids.values())).delete()
+    RelevantChange.objects.bulk_create([RelevantChange(result_id=result_ids[sha],
+                                                       file=change.file,
+                                                       line=change.line,
+                                                       position=change.position,
+                                                       change_type=change_type_to_relevance_type(change.change_type),
+                                                       node_kind=change.node_kind)
+                                        for sha, detected in changes.items() if sha in result_ids
+                                        for change in detected],
+                                       batch_size=METRICS_BATCH_SIZE)
+
+def upsert(model, project: Project, objs: list, update_fields: List[str], batch_size: int):
+    # Stores rows unique by project and hash.  bulk_create(update_conflicts=True)
+    # isn't supported on MySQL, so rows which exist already are updated instead.
+    existing = dict(model.objects.filter(project=project, hash__in=[obj.hash for obj in objs])
+                    .values_list('hash', 'id'))
+    for obj in objs:
+        obj.pk = existing.get(obj.hash)
+    model.objects.bulk_update([obj for obj in objs if obj.pk is not None], update_fields, batch_size=batch_size)
+    model.objects.bulk_create([obj for obj in objs if obj.pk is None], batch_size=batch_size)
+
+def record_result(project: Project, sha: str, changes: Optional[List[DetectedChange]], complete: bool = True):
+    # Incomplete changes (from an early exit) only record the outcome, the
+    # stored changes are left to metrics collection.
+    with transaction.atomic():
+        RelevanceResult.objects.update_or_create(project=project, hash=sha,
+                                                 defaults={'outcome': (RelevanceResult.Outcome.RELEVANT if changes is not None
+                                                                       else RelevanceResult.Outcome.IRRELEVANT),
+                                                           'detector_version': detector_version(project.language),
+                                                           'error': None})
+        if complete or changes is None:
+            save_changes(project, {sha: changes or []})
+
+def needs_reevaluation(project: Project) -> bool:
+    return bool(RelevanceResult.objects.filter(project=project).exclude(detector_version=detector_version(project.language)).exists())
+
+def restart_collection(project: Project):
+    MetricsCheckpoint.objects.filter(project=project).delete()
+    project.metrics_collected = False
+    project.save()
+
+def pending_revisions(repo: Repo, checkpoint: MetricsCheckpoint) -> Iterator[CommitRecord]:
+    revisions = [checkpoint.ref] + ([f'^{checkpoint.base}'] if checkpoint.base is not None else [])
+    skipping = checkpoint.hash is not None
+    for record in walk_commits(repo.working_dir, *revisions):
+        if skipping:
+            skipping = record.sha != checkpoint.hash
+            continue
+        if not record.is_root:
+            yield record
+
+class MetricsCollector:
+
+    def __init__(self, workers: Optional[int] = None, batch_size: int = METRICS_BATCH_SIZE):
+        self.workers = workers or METRICS_WORKERS or os.cpu_count()
+        self.batch_size = batch_size
+        self.pool: Optional[multiprocessing.pool.Pool] = None
+        self.resolver: Optional[IdentityResolver] = None
+        self.outdated: Set[str] = set()
+
+    def __enter__(self):
+        # A single worker runs inline, e.g. within a (daemonic) Celery worker process.
+        if self.workers > 1:
+            # Forked workers must not share the parent's database connections.
+            connections.close_all()
+            self.pool = multiprocessing.get_context('fork').Pool(self.workers)
+        return self
+
+    def __exit__(self, *args):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def make_metrics(self, project: Project, repo: Repo, relevant: List[Tuple[str, List[DetectedChange]]]) -> List[MetricsCommit]:
+        raw_commits = [repo.commit(sha) for sha, _ in relevant]
+        if self.resolver is None:
+            self.resolver = IdentityResolver(project)
+        logins = self.resolver.resolve([(person.email, raw_commit.hexsha)
+                                        for raw_commit in raw_commits
+                                        for person in (raw_commit.author, raw_commit.committer)
+                                        if person.email])
+
+        metrics = []
+        for raw_commit, (sha, changes) in zip(raw_commits, relevant):
+            # The first change stays on the commit itself; all of them are kept as RelevantChanges.
+            first_change = changes[0]
+            metrics.append(MetricsCommit(project=project,
+                                         hash=sha,
+                                         relevance_type=change_type_to_relevance_type(first_change.change_type),
+                                         relevant_change_file=first_change.file,
+                                         relevant_change_line=first_change.position,
+                                         created_at=raw_commit.committed_datetime,
+                                         author=logins.get((raw_commit.author.email or '').lower()),
+                                         committer=logins.get((raw_commit.committer.email or '').lower())))
+        return metrics
+
+    def save_batch(self, project: Project, repo: Repo, checkpoint: MetricsCheckpoint,
+                   relevant: List[Tuple[str, List[DetectedChange]]], results: List[RelevanceResult], last_sha: str) -> int:
+        metrics = self.make_metrics(project, repo, relevant)
+        # Commits a previous detector version found relevant may no longer be.
+        irrelevant = [result.hash for result in results
+                      if result.outcome == RelevanceResult.Outcome.IRRELEVANT and result.hash in self.outdated]
+        with transaction.atomic():
+            upsert(MetricsCommit, project, metrics,
+                   ['relevance_type', 'relevant_change_file', 'relevant_change_line', 'author', 'committer'],
+                   self.batch_size)
+            if len(irrelevant) > 0:
+                MetricsCommit.objects.filter(project=project, hash__in=irrelevant).delete()
+            # bulk_update doesn't set auto_now fields.
+            checked_at = timezone.now()
+            for result in results:
+                result.checked_at = checked_at
+            upsert(RelevanceResult, project, results, ['outcome', 'detector_version', 'error', 'checked_at'], self.batch_size)
+            changes: Dict[str, List[DetectedChange]] = {result.hash: [] for result in results}
+            changes.update(relevant)
+            save_changes(project, changes)
+            checkpoint.hash = last_sha
+            checkpoint.save()
+        for metric in metrics:
+            logger.debug(f'Processed commit {metric.hash} of {project} with relevance type {metric.relevance_type} in file {metric.relevant_change_file} at line {metric.relevant_change_line}.')
+        return len(metrics)
+
+    def collect(self, project: Project, progress: Optional[Callable[[int, int], None]] = None,
+                deadline: Optional[float] = None) -> int:
+        # Stops once time.monotonic() passes `deadline', leaving the rest to a
+        # later call resuming from the checkpoint; the checkpoint then isn't complete.
+        repo = Repo(project.path)
+        self.resolver = IdentityResolver(project)
+        checkpoint = get_checkpoint(project, repo)
+        if checkpoint.complete:
+            if not project.metrics_collected:
+                project.metrics_collected = True
+                project.save()
+            return 0
+        if checkpoint.hash is not None:
+            logger.info(f'Resuming {project} after commit {checkpoint.hash}.')
+        elif checkpoint.base is not None:
+            logger.info(f'Collecting commits of {project} since {checkpoint.base}.')
+
+        # Commits already checked by this version of the detector are skipped;
+        # errors are always retried.
+        version = detector_version(project.language)
+        stored = RelevanceResult.objects.filter(project=project).exclude(outcome=RelevanceResult.Outcome.ERROR)
+        current = stored.filter(detector_version=version)
+        known = set(current.filter(outcome=RelevanceResult.Outcome.IRRELEVANT).values_list('hash', flat=True))
+        known.update(set(current.filter(outcome=RelevanceResult.Outcome.RELEVANT).values_list('hash', flat=True))
+                     & set(MetricsCommit.objects.filter(project=project).values_list('hash', flat=True)))
+        self.outdated = set(stored.exclude(detector_version=version).values_list('hash', flat=True))
+
+        # Changed files come from the walker; commits without a modified file in
+        # the project's language are answered by the workers without any git call.
+        jobs = ((str(project.path), project.language, record.sha,
+                 [] if record.sha in known else
+                 [path for path in record.modified_paths() if file_is_relevant(path, project.language)])
+                for record in pending_revisions(repo, checkpoint) if not record.is_merge)
+        batch = []
+        results = []
+        processed = 0
+        relevant = 0
+        last_sha = None
+        paused = False
+        checked = self.pool.imap(check_revision, jobs, chunksize=32) if self.pool is not None else map(check_revision, jobs)
+        for sha, detector_ran, changes, error in checked:
+            if error is not None:
+                logger.warning(f'Failed to check commit {sha} of {project}: {error}')
+                results.append(RelevanceResult(project=project, hash=sha, detector_version=version,
+                                               outcome=RelevanceResult.Outcome.ERROR, error=error))
+            elif detector_ran:
+                if changes is not None:
+                    batch.append((sha, changes))
+                results.append(RelevanceResult(project=project, hash=sha, detector_version=version,
+                                               outcome=(RelevanceResult.Outcome.RELEVANT if changes is not None
+                                                        else RelevanceResult.Outcome.IRRELEVANT)))
+            processed += 1
+            last_sha = sha
+            if processed % self.batch_size == 0:
+                relevant += self.save_batch(project, repo, checkpoint, batch, results, last_sha)
+                batch = []
+                results = []
+                if progress is not None:
+                    progress(processed, relevant)
+            if deadline is not None and time.monotonic() >= deadline:
+                paused = True
+                break
+
+        if last_sha is not None:
+            relevant += self.save_batch(project, repo, checkpoint, batch, results, last_sha)
+            if progress is not None:
+                progress(processed, relevant)
+        if paused:
+            logger.info(f'Paused {project} after commit {last_sha}.')
+            return relevant
+
+        checkpoint.complete = True
+        checkpoint.save()
+        project.metrics_collected = True
+        project.save()
+        return relevant
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0077_project_had_installation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricsCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ref', models.CharField(editable=False, max_length=40, verbose_name='commit collection started from')),
+                ('hash', models.CharField(editable=False, max_length=40, null=True, verbose_name='last processed commit')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='last update')),
+                ('project', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='survey.project')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='metricscheckpoint',
+            constraint=models.UniqueConstraint(fields=('project',), name='unique_metricscheckpoint_project'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+def seed_identities(apps, schema_editor):
+    # Logins already fetched from the REST API for relevant commits.
+    Commit = apps.get_model('survey', 'Commit')
+    CommitterIdentity = apps.get_model('survey', 'CommitterIdentity')
+    identities = {}
+    for json_data in Commit.objects.filter(json_data__isnull=False).values_list('json_data', flat=True).iterator():
+        for role in ('author', 'committer'):
+            user = json_data.get(role)
+            person = (json_data.get('commit') or {}).get(role)
+            if user and person and person.get('email'):
+                identities[person['email'].lower()] = user['login']
+    CommitterIdentity.objects.bulk_create([CommitterIdentity(email=email, login=login) for email, login in identities.items()],
+                                          ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0078_metricscheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommitterIdentity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(editable=False, max_length=254, verbose_name='git email address')),
+                ('login', models.CharField(editable=False, max_length=200, null=True, verbose_name='GitHub login')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='last update')),
+            ],
+            options={
+                'verbose_name_plural': 'Committer identities',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='committeridentity',
+            constraint=models.UniqueConstraint(fields=('email',), name='unique_committeridentity_email'),
+        ),
+        migrations.RunPython(seed_identities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+def mark_collected_checkpoints(apps, schema_editor):
+    MetricsCheckpoint = apps.get_model('survey', 'MetricsCheckpoint')
+    MetricsCheckpoint.objects.filter(project__metrics_collected=True).update(complete=True)
+
+def create_incremental_metrics_task(apps, schema_editor):
+    IntervalSchedule = apps.get_model('django_celery_beat', 'IntervalSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    schedule, created = IntervalSchedule.objects.get_or_create(every=1, period='hours')
+    if created:
+        schedule.save()
+    task = PeriodicTask(interval=schedule, name='collect_new_metrics', task='survey.tasks.periodic.collect_new_metrics')
+    task.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0079_committeridentity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metricscheckpoint',
+            name='base',
+            field=models.CharField(editable=False, max_length=40, null=True, verbose_name='commit collection stops at'),
+        ),
+        migrations.AddField(
+            model_name='metricscheckpoint',
+            name='complete',
+            field=models.BooleanField(default=False, editable=False, verbose_name='all commits up to ref processed?'),
+        ),
+        migrations.RunPython(mark_collected_checkpoints, migrations.RunPython.noop),
+        migrations.RunPython(create_incremental_metrics_task),
+    ]
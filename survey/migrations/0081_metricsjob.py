@@ -0,0 +1,37 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_new_metrics_task(apps, schema_editor):
+    # collect_new_metrics now goes through the metrics job coordinator.
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name='collect_new_metrics').update(task='survey.tasks.metrics.collect_new_metrics')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0080_metricscheckpoint_base_complete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricsJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('incremental', models.BooleanField(default=False, editable=False, verbose_name='only new commits?')),
+                ('status', models.CharField(choices=[('QU', 'Queued'), ('RU', 'Running'), ('DO', 'Done'), ('FA', 'Failed')], default='QU', editable=False, max_length=2)),
+                ('processed_commits', models.IntegerField(default=0, editable=False)),
+                ('relevant_commits', models.IntegerField(default=0, editable=False)),
+                ('error', models.TextField(blank=True, editable=False, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(editable=False, null=True)),
+                ('node', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='survey.node')),
+                ('project', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='survey.project')),
+            ],
+        ),
+        migrations.RunPython(move_new_metrics_task, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0081_metricsjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelevanceResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(editable=False, max_length=40)),
+                ('outcome', models.CharField(choices=[('RE', 'Relevant'), ('IR', 'Irrelevant'), ('ER', 'Error')], editable=False, max_length=2)),
+                ('detector_version', models.CharField(editable=False, max_length=40)),
+                ('error', models.TextField(blank=True, editable=False, null=True)),
+                ('checked_at', models.DateTimeField(auto_now=True)),
+                ('project', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='survey.project')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='relevanceresult',
+            constraint=models.UniqueConstraint(fields=('project', 'hash'), name='unique_relevanceresult_hash_in_project'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0082_relevanceresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelevantChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.TextField(editable=False)),
+                ('line', models.IntegerField(editable=False)),
+                ('position', models.IntegerField(editable=False, null=True)),
+                ('change_type', models.CharField(choices=[('IR', 'Irrelevant'), ('AD', 'Added'), ('RM', 'Removed'), ('CH', 'Changed')], editable=False, max_length=2)),
+                ('node_kind', models.CharField(editable=False, max_length=100)),
+                ('result', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='survey.relevanceresult')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.16 on 2026-10-18 15:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0083_relevantchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='disk_free',
+            field=models.BigIntegerField(editable=False, null=True, verbose_name='free disk space'),
+        ),
+        migrations.CreateModel(
+            name='ProjectUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('disk_size', models.BigIntegerField(editable=False, null=True, verbose_name='size on disk')),
+                ('fetch_count', models.IntegerField(default=0, editable=False, verbose_name='number of fetches')),
+                ('check_cpu_time', models.FloatField(default=0, editable=False, verbose_name='relevance check CPU time')),
+                ('since', models.DateTimeField(auto_now_add=True, verbose_name='counted since')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='last update')),
+                ('project', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='survey.project')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='projectusage',
+            constraint=models.UniqueConstraint(fields=('project',), name='unique_projectusage_project'),
+        ),
+    ]
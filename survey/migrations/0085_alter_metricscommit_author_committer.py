@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+def clear_unknown_logins(apps, schema_editor):
+    # Unknown logins used to be stored as empty strings.
+    MetricsCommit = apps.get_model('survey', 'MetricsCommit')
+    MetricsCommit.objects.filter(author='').update(author=None)
+    MetricsCommit.objects.filter(committer='').update(committer=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0084_projectusage_node_disk_free'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='metricscommit',
+            name='author',
+            field=models.CharField(editable=False, max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='metricscommit',
+            name='committer',
+            field=models.CharField(editable=False, max_length=200, null=True),
+        ),
+        migrations.RunPython(clear_unknown_logins, migrations.RunPython.noop),
+    ]
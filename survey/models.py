@@ -24,6 +24,7 @@ class Node(models.Model):
     last_active = models.DateTimeField(auto_now_add=True)
     enabled = models.BooleanField(default=True, null=False)
     use_datadir_subdirs = models.BooleanField(default=False, null=False)
+    disk_free = models.BigIntegerField('free disk space', editable=False, null=True)
 
     def __str__(self):
         return self.hostname
@@ -220,11 +221,15 @@ class Project(models.Model):
         return self._repo
 
     @property
-    def path(self) -> Path:
+    def data_root(self) -> Path:
         if self.data_subdir is not None:
-            return settings.DATA_DIR / self.data_subdir / self.owner / self.name
+            return settings.DATA_DIR / self.data_subdir
         else:
-            return settings.DATA_DIR / self.owner / self.name
+            return settings.DATA_DIR
+
+    @property
+    def path(self) -> Path:
+        return Path(self.data_root, self.owner, self.name)
 
     @property
     def is_on_current_node(self) -> bool:
@@ -412,8 +417,9 @@ class MetricsCommit(models.Model):
     relevant_change_line = models.IntegerField(null=True, editable=False)
 
     created_at = models.DateTimeField(auto_now_add=True, editable=False)
-    author = models.CharField(max_length=200, editable=False)
-    committer = models.CharField(max_length=200, editable=False)
+    # Logins GitHub doesn't know are left empty, rather than being counted as one author.
+    author = models.CharField(max_length=200, null=True, editable=False)
+    committer = models.CharField(max_length=200, null=True, editable=False)
 
     _commit = None
 
@@ -435,3 +441,107 @@ class MetricsCommit(models.Model):
             return self._commit
         self._commit = self.project.gh.get_commit(sha=self.hash)
         return self._commit
+
+class MetricsCheckpoint(models.Model):
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, editable=False)
+    ref = models.CharField('commit collection started from', max_length=40, editable=False)
+    base = models.CharField('commit collection stops at', max_length=40, editable=False, null=True)
+    hash = models.CharField('last processed commit', max_length=40, editable=False, null=True)
+    complete = models.BooleanField('all commits up to ref processed?', editable=False, default=False)
+    updated_at = models.DateTimeField('last update', auto_now=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project'], name='unique_metricscheckpoint_project')
+        ]
+
+    def __str__(self):
+        return f'{self.project} at {self.hash}'
+
+class ProjectUsage(models.Model):
+    # Kept apart from Project, so that saving a project doesn't overwrite counters updated meanwhile.
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, editable=False)
+    disk_size = models.BigIntegerField('size on disk', editable=False, null=True)
+    fetch_count = models.IntegerField('number of fetches', editable=False, default=0)
+    check_cpu_time = models.FloatField('relevance check CPU time', editable=False, default=0)
+    since = models.DateTimeField('counted since', auto_now_add=True, editable=False)
+    updated_at = models.DateTimeField('last update', auto_now=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project'], name='unique_projectusage_project')
+        ]
+
+    def __str__(self):
+        return f'{self.project} usage'
+
+class CommitterIdentity(models.Model):
+    email = models.CharField('git email address', max_length=254, editable=False)
+    login = models.CharField('GitHub login', max_length=200, null=True, editable=False)
+    updated_at = models.DateTimeField('last update', auto_now=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['email'], name='unique_committeridentity_email')
+        ]
+        verbose_name_plural = "Committer identities"
+
+    def __str__(self):
+        return f'{self.email} ({self.login})'
+
+class MetricsJob(models.Model):
+    class JobStatus(models.TextChoices):
+        QUEUED = ('QU', "Queued")
+        RUNNING = ('RU', "Running")
+        DONE = ('DO', "Done")
+        FAILED = ('FA', "Failed")
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, editable=False)
+    node = models.ForeignKey(Node, on_delete=models.CASCADE, editable=False)
+    incremental = models.BooleanField('only new commits?', editable=False, default=False)
+    status = models.CharField(max_length=2,
+                              choices=JobStatus.choices,
+                              default=JobStatus.QUEUED,
+                              editable=False)
+    processed_commits = models.IntegerField(editable=False, default=0)
+    relevant_commits = models.IntegerField(editable=False, default=0)
+    error = models.TextField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, editable=False)
+    finished_at = models.DateTimeField(null=True, editable=False)
+
+    def __str__(self):
+        return f'{self.project} on {self.node} ({self.get_status_display()})'
+
+class RelevanceResult(models.Model):
+    class Outcome(models.TextChoices):
+        RELEVANT = ('RE', "Relevant")
+        IRRELEVANT = ('IR', "Irrelevant")
+        ERROR = ('ER', "Error")
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, editable=False)
+    hash = models.CharField(max_length=40, editable=False)
+    outcome = models.CharField(max_length=2, choices=Outcome.choices, editable=False)
+    detector_version = models.CharField(max_length=40, editable=False)
+    error = models.TextField(null=True, blank=True, editable=False)
+    checked_at = models.DateTimeField(auto_now=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'hash'], name='unique_relevanceresult_hash_in_project')
+        ]
+
+    def __str__(self):
+        return f'{self.hash} ({self.get_outcome_display()})'
+
+class RelevantChange(models.Model):
+    result = models.ForeignKey(RelevanceResult, on_delete=models.CASCADE, editable=False, related_name='changes')
+    file = models.TextField(editable=False)
+    line = models.IntegerField(editable=False)
+    # Position within the file's patch, as used for commit comments.
+    position = models.IntegerField(null=True, editable=False)
+    change_type = models.CharField(max_length=2, choices=MetricsCommit.RelevanceType.choices, editable=False)
+    node_kind = models.CharField(max_length=100, editable=False)
+
+    def __str__(self):
+        return f'{self.file}:{self.line} ({self.get_change_type_display()} {self.node_kind})'
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Cheap textual check run on the hunks of a file before its AST diff.  A file
+# is only skipped when none of its changed lines could belong to a type
+# annotation; anything that looks even remotely like one is passed on.
+#
+# In `conservative' mode strings and comments are not stripped, and the
+# context lines of each hunk are scanned too, so that a change deep inside a
+# multi-line annotation (e.g. one member of a long `Union[...]') still counts.
+
+import re
+from typing import Dict, List, Optional
+
+from .patches import FilePatch
+
+PREFILTER_MODES = ['on', 'conservative', 'off']
+
+STRINGS = {
+    'python': re.compile(r'\'(?:\\.|[^\'\\])*\'|"(?:\\.|[^"\\])*"'),
+    'typescript': re.compile(r'\'(?:\\.|[^\'\\])*\'|"(?:\\.|[^"\\])*"|`(?:\\.|[^`\\])*`')
+}
+
+COMMENTS = {
+    'python': re.compile(r'#.*$'),
+    'typescript': re.compile(r'//.*$|/\*.*?(\*/|$)')
+}
+
+BLOCK_COLON = {
+    'python': re.compile(r':\s*$'),
+    'typescript': None
+}
+
+ANNOTATION_HINTS = {
+    # Annotations, return types, generic parameters and `type' statements.
+    'python': re.compile(r':(?!=)|->|^\s*type\s+\w|\b(def|class)\s+\w+\s*\['),
+    # Annotations, generics, assertions and type-level declarations.
+    'typescript': re.compile(r':|<|\b(as|satisfies|interface|type|implements|extends|keyof|typeof|infer|enum|declare|namespace)\b')
+}
+
+PREFILTER_LANGUAGES = {
+    'py': 'python',
+    'python': 'python',
+    'ts': 'typescript',
+    'typescript': 'typescript'
+}
+
+def line_has_hint(line: str, language: str, conservative: bool = False) -> bool:
+    if not conservative:
+        line = STRINGS[language].sub('""', line)
+        line = COMMENTS[language].sub('', line)
+    block_colon = BLOCK_COLON[language]
+    if block_colon is not None:
+        line = block_colon.sub('', line)
+    return ANNOTATION_HINTS[language].search(line) is not None
+
+def may_change_annotations(patch, language: str, conservative: bool = False) -> bool:
+    if patch.changes is None or len(patch.changes) == 0:
+        # Binary, mode-only or rename-only changes have no text to scan.
+        return False
+    for change in patch.changes:
+        is_changed = change.old is None or change.new is None
+        if (is_changed or conservative) and line_has_hint(change.line, language, conservative):
+            return True
+    return False
+
+def filter_paths(patches: Dict[str, FilePatch], paths: List[str], language: str, mode: str) -> Optional[List[str]]:
+    if mode == 'off' or language not in PREFILTER_LANGUAGES:
+        return None
+    language = PREFILTER_LANGUAGES[language]
+    conservative = mode == 'conservative'
+
+    # Paths git reports differently (e.g. renames) are always kept.
+    return [path for path in paths
+            if path not in patches or may_change_annotations(patches[path].diff, language, conservative)]
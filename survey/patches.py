@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Unified patches computed from the local clone.  `FilePatch.text' has the same
+# shape as the `patch' field GitHub returns for a commit file (starting at the
+# first hunk header), so comment positions match what GitHub expects.
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from git import Commit
+import whatthepatch
+
+hunk_header_re = re.compile(r'^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+
+class FilePatch:
+
+    def __init__(self, path: str, text: str, diff):
+        self.path = path
+        self.text = text
+        self.diff = diff
+        self._new_positions: Optional[Dict[int, int]] = None
+        self._old_positions: Optional[Dict[int, int]] = None
+
+    def __str__(self):
+        return f'FilePatch(\'{self.path}\')'
+
+    def _index_positions(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+        # Position 1 is the line below the first hunk header; later hunk
+        # headers count as lines too.
+        new_positions: Dict[int, int] = {}
+        old_positions: Dict[int, int] = {}
+        old_line = new_line = 0
+        for position, line in enumerate(self.text.split('\n')):
+            if line.startswith('@@'):
+                match = hunk_header_re.match(line)
+                if match is not None:
+                    old_line, new_line = map(int, match.groups())
+                continue
+            if line.startswith('+'):
+                new_positions.setdefault(new_line, position)
+                new_line += 1
+            elif line.startswith('-'):
+                old_positions.setdefault(old_line, position)
+                old_line += 1
+            elif line.startswith(' '):
+                new_positions.setdefault(new_line, position)
+                old_positions.setdefault(old_line, position)
+                new_line += 1
+                old_line += 1
+        return new_positions, old_positions
+
+    @property
+    def lines_changed(self) -> int:
+        return sum(1 for line in self.text.split('\n') if line.startswith(('+', '-')))
+
+    def position(self, line: int, old: bool = False) -> Optional[int]:
+        if self._new_positions is None or self._old_positions is None:
+            self._new_positions, self._old_positions = self._index_positions()
+        return (self._old_positions if old else self._new_positions).get(line)
+
+def commit_patches(commit: Commit, paths: Optional[List[str]] = None, context: int = 3) -> Dict[str, FilePatch]:
+    diff_text = commit.repo.git.diff(commit.parents[0].hexsha, commit.hexsha,
+                                     '--no-color', '--no-ext-diff', '-M', f'-U{context}',
+                                     '--', *(paths or []))
+
+    patches = {}
+    for file_text in re.split(r'^(?=diff --git )', diff_text, flags=re.MULTILINE):
+        if file_text == '':
+            continue
+        diff = next(whatthepatch.parse_patch(file_text), None)
+        if diff is None or diff.header is None:
+            continue
+        hunk_start = file_text.find('\n@@')
+        text = file_text[hunk_start + 1:] if hunk_start >= 0 else ''
+        patches[diff.header.new_path] = FilePatch(diff.header.new_path, text.rstrip('\n'), diff)
+    return patches
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Places projects on nodes, and on the data directories of a node, by a
+# weighted cost of their size on disk, how often they are fetched and the CPU
+# time their relevance checks take.  Each measure is relative to the average
+# tracked project, so a project which hasn't been measured yet costs about as
+# much as an average one.  Nodes are only used while the project fits on
+# their disks with PLACEMENT_DISK_RESERVE to spare, and only once their
+# worker has answered a recent health check: every host which loads the tasks
+# (the web server too) registers an enabled node, whose queue may have no
+# worker.
+
+import os
+import shutil
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from decouple import config
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from git import Repo
+
+from .models import Node, Project, ProjectUsage
+
+PLACEMENT_DISK_WEIGHT = config('PLACEMENT_DISK_WEIGHT', default=1.0, cast=float)
+PLACEMENT_FETCH_WEIGHT = config('PLACEMENT_FETCH_WEIGHT', default=1.0, cast=float)
+PLACEMENT_CPU_WEIGHT = config('PLACEMENT_CPU_WEIGHT', default=1.0, cast=float)
+PLACEMENT_DISK_RESERVE = config('PLACEMENT_DISK_RESERVE', default=10, cast=int) # GiB
+
+# Nodes which haven't answered a health check for this long are disabled.
+NODE_ACTIVE_WINDOW = timedelta(minutes=30)
+
+def repository_size(path: Path) -> int:
+    # The clone's own objects, without any it borrows from an object pool.
+    output = Repo(path).git.count_objects('-v')
+    values = dict(line.split(': ', 1) for line in output.splitlines())
+    return (int(values.get('size', 0)) + int(values.get('size-pack', 0))) * 1024
+
+def get_usage(project: Project) -> ProjectUsage:
+    usage: ProjectUsage = ProjectUsage.objects.get_or_create(project=project)[0]
+    return usage
+
+def record_disk_size(project: Project):
+    ProjectUsage.objects.filter(id=get_usage(project).id).update(disk_size=repository_size(project.path),
+                                                                 updated_at=timezone.now())
+
+def record_fetch(project: Project):
+    ProjectUsage.objects.filter(id=get_usage(project).id).update(fetch_count=F('fetch_count') + 1,
+                                                                 disk_size=repository_size(project.path),
+                                                                 updated_at=timezone.now())
+
+def record_check_time(project: Project, seconds: float):
+    ProjectUsage.objects.filter(id=get_usage(project).id).update(check_cpu_time=F('check_cpu_time') + seconds,
+                                                                 updated_at=timezone.now())
+
+def data_subdirs() -> List[Path]:
+    # Symlinks to data directories on other disks; the data directory is created on first use.
+    settings.DATA_DIR.mkdir(parents=True, exist_ok=True)
+    return [path for path in settings.DATA_DIR.iterdir() if path.is_symlink()]
+
+def data_directories() -> List[Path]:
+    # The data subdirectories, or the data directory itself.
+    return data_subdirs() or [settings.DATA_DIR]
+
+def disk_free(path: Path) -> Optional[Tuple[int, int]]:
+    # The device and free space of a data directory; None for broken links.
+    try:
+        target = path.resolve()
+        return os.stat(target).st_dev, shutil.disk_usage(target).free
+    except OSError:
+        return None
+
+def node_disk_free() -> int:
+    # Disks holding several data directories are counted once.
+    free = {}
+    for path in data_directories():
+        usage = disk_free(path)
+        if usage is not None:
+            free[usage[0]] = usage[1]
+    return sum(free.values())
+
+def has_room(free: Optional[int], size: int) -> bool:
+    return free is None or free - size >= PLACEMENT_DISK_RESERVE * 1024 ** 3
+
+def tracked_projects() -> List[Project]:
+    return list(Project.objects.filter(track_changes=True, host_node__isnull=False).select_related('host_node'))
+
+def project_costs(projects: Iterable[Project]) -> Dict[int, float]:
+    projects = list(projects)
+    now = timezone.now()
+    usages = {usage.project_id: usage for usage in ProjectUsage.objects.filter(project__in=projects)}
+
+    measures: Dict[int, Tuple[Optional[float], ...]] = {}
+    for project in projects:
+        usage = usages.get(project.id)
+        if usage is None:
+            measures[project.id] = (None, None, None)
+            continue
+        # Rates per day, over at least a day so new projects don't stand out.
+        days = max((now - usage.since).total_seconds() / 86400, 1)
+        measures[project.id] = (usage.disk_size, usage.fetch_count / days, usage.check_cpu_time / days)
+
+    weights = (PLACEMENT_DISK_WEIGHT, PLACEMENT_FETCH_WEIGHT, PLACEMENT_CPU_WEIGHT)
+    means = []
+    for i in range(len(weights)):
+        known = [value for value in (measure[i] for measure in measures.values()) if value is not None]
+        means.append(sum(known) / len(known) if len(known) > 0 else 0)
+
+    costs = {}
+    for project_id, measure in measures.items():
+        relative = [(value / mean if value is not None and mean > 0 else 1.0)
+                    for value, mean in zip(measure, means)]
+        costs[project_id] = sum(weight * value for weight, value in zip(weights, relative)) / (sum(weights) or 1)
+    return costs
+
+def expected_size(project: Project) -> int:
+    # Unmeasured projects are assumed to be as large as the average one.
+    usage = ProjectUsage.objects.filter(project=project, disk_size__isnull=False).first()
+    if usage is not None:
+        return int(usage.disk_size)
+    sizes = list(ProjectUsage.objects.filter(disk_size__isnull=False).values_list('disk_size', flat=True))
+    return int(sum(sizes) // len(sizes)) if len(sizes) > 0 else 0
+
+def node_loads(projects: Iterable[Project], costs: Dict[int, float]) -> Dict[int, float]:
+    loads: Dict[int, float] = {}
+    for project in projects:
+        if project.host_node_id is not None:
+            loads[project.host_node_id] = loads.get(project.host_node_id, 0) + costs.get(project.id, 1.0)
+    return loads
+
+def placeable_nodes() -> List[Node]:
+    # Enabled nodes whose worker recently answered a health check, which also reports its free disk space.
+    return list(Node.objects.filter(enabled=True, disk_free__isnull=False,
+                                    last_active__gt=timezone.now() - NODE_ACTIVE_WINDOW))
+
+def choose_node(project: Project) -> Optional[Node]:
+    # The placeable node with the lowest load that has room for the project.
+    projects = [tracked for tracked in tracked_projects() if tracked.id != project.id]
+    loads = node_loads(projects, project_costs(projects + [project]))
+    size = expected_size(project)
+    candidates = [node for node in placeable_nodes() if has_room(node.disk_free, size)]
+    if len(candidates) == 0:
+        return None
+    return min(candidates, key=lambda node: (loads.get(node.id, 0), node.hostname))
+
+def choose_data_subdir(project: Project) -> Optional[str]:
+    # The data subdirectory with the most free space, if the project fits at all.
+    usages = {path: disk_free(path) for path in data_subdirs()}
+    locations = {path: usage[1] for path, usage in usages.items() if usage is not None}
+    size = expected_size(project)
+    locations = {path: free for path, free in locations.items() if has_room(free, size)} or locations
+    if len(locations) == 0:
+        return None
+    return str(max(locations, key=lambda path: locations[path]).parts[-1])
@@ -9,6 +9,8 @@ from .repos import *
 
 from .periodic import *
 
+from .metrics import *
+
 from .util_tasks import *
 
 from .screening import *
@@ -11,6 +11,9 @@ from django.db.utils import IntegrityError
 from survey.models import Committer, Commit, Project, ProjectCommitter, Response, Node
 from survey.utils import *
 from survey.project_mining_utils import collect_repo_maintainers
+from survey.identities import record_raw_commit
+from survey.metrics import record_result
+from survey.placement import record_check_time
 
 from django.conf import settings
 from django.utils import timezone
@@ -22,17 +25,18 @@ from git import Repo
 from pathlib import Path
 
 import re
+import time
 
 consent_command: re.Pattern = re.compile(f'^\\s*@{settings.GITHUB_APP_NAME}(\\[bot\\])?\\sconsent', re.IGNORECASE)
 optout_command = re.compile(f'^\\s*@{settings.GITHUB_APP_NAME}(\\[bot\\])?\\soptout', re.IGNORECASE)
 remove_command = re.compile(f'^\\s*@{settings.GITHUB_APP_NAME}(\\[bot\\])?\\sremove', re.IGNORECASE)
 
 @app.task(ignore_result = True)
-def process_push_data(owner, repo, commits):
+def process_push_data(owner, repo, commits, ref=None):
     project = Project.objects.get(Q(owner=owner) & Q(name=repo))
 
     if project.track_changes:
-        fetch_project(project.id)
+        fetch_project(project.id, [commit_data['id'] for commit_data in commits], ref)
         for commit_data in commits:
             try:
                 commit = Commit(project=project,
@@ -50,27 +54,16 @@ def process_push_data(owner, repo, commits):
             except:
                 continue
 
-def change_type_to_relevance_type(change_type: ChangeType):
-    match change_type:
-        case ChangeType.ADDED:
-            return Commit.RelevanceType.ADDED
-        case ChangeType.REMOVED:
-            return Commit.RelevanceType.REMOVED
-        case ChangeType.CHANGED:
-            return Commit.RelevanceType.CHANGED
-        case _:
-            return Commit.RelevanceType.CHANGED
-
 @app.task(bind=True, autoretry_for=(ValueError,), retry_backoff=2, max_retries=5)
 def post_process_old_commit(self, commit_pk: int):
     commit = Commit.objects.get(id=commit_pk)
     project = commit.project
 
     if commit.is_relevant and commit.relevance_type == Commit.RelevanceType.IRRELEVANT:
-        relevant_file, relevant_line, change_type = check_commit_is_relevant(Repo(project.path), commit)[0]
-        commit.relevance_type = change_type_to_relevance_type(change_type)
-        commit.relevant_change_file = relevant_file
-        commit.relevant_change_line = relevant_line
+        change = check_commit_is_relevant(Repo(project.path), commit, first_only=True)[0]
+        commit.relevance_type = change_type_to_relevance_type(change.change_type)
+        commit.relevant_change_file = change.file
+        commit.relevant_change_line = change.position
         commit.save()
 
 @app.task(bind = True, autoretry_for=(ValueError,), retry_backoff=2, max_retries=5)
@@ -78,16 +71,22 @@ def process_commit(self, commit_pk: int):
     commit = Commit.objects.get(id=commit_pk)
     project = commit.project
 
-    commit_is_relevant = check_commit_is_relevant(Repo(project.path), commit)
+    # Only the first relevant change is needed here; metrics collection finds the others.
+    started = time.process_time()
+    commit_is_relevant = check_commit_is_relevant(Repo(project.path), commit, first_only=True)
+    record_check_time(project, time.process_time() - started)
+    # Irrelevant commits are vacuumed later, their outcome is kept here.
+    record_result(project, commit.hash, commit_is_relevant, complete=False)
     if commit_is_relevant is None:
         commit.is_relevant = False
         commit.save()
         return
-    relevant_file, relevant_line, change_type = commit_is_relevant[0]
+    first_change = commit_is_relevant[0]
     commit.json_data = commit.gh.raw_data
-    commit.relevance_type = change_type_to_relevance_type(change_type)
-    commit.relevant_change_file = relevant_file
-    commit.relevant_change_line = relevant_line
+    record_raw_commit(commit.json_data)
+    commit.relevance_type = change_type_to_relevance_type(first_change.change_type)
+    commit.relevant_change_file = first_change.file
+    commit.relevant_change_line = first_change.position
     commit.is_relevant = True
     commit.save()
 
@@ -131,14 +130,18 @@ def process_commit(self, commit_pk: int):
             notify_who.append(commit.gh.committer.login)
 
         if len(notify_who) > 0:
-            file, line, change_type = commit_is_relevant[0]
             survey_template = loader.get_template('survey.md')
             template_data = {
                 'BOT_NAME': settings.GITHUB_APP_NAME,
                 'USER': ', '.join(list(f'@{login}' for login in notify_who[::-1])),
-                'ADDED': change_type.value
+                'ADDED': first_change.change_type.value
             }
-            commit.gh.create_comment(survey_template.render(template_data), position = line, path = file)
+            # Patch positions start at 1; older results stored 0 for lines outside the patch.
+            if first_change.position:
+                commit.gh.create_comment(survey_template.render(template_data), position = first_change.position, path = first_change.file)
+            else:
+                # Without a position in the file's patch, the comment goes on the commit itself.
+                commit.gh.create_comment(survey_template.render(template_data))
             for username in notify_who:
                 user = Committer.objects.get(username=username)
                 user.last_contact_date = timezone.now()
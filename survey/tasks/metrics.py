@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from .common import app, current_node, celery_logger
+
+from decouple import config
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
+import time
+
+from survey.models import MetricsCheckpoint, MetricsJob, Project
+from survey.metrics import MetricsCollector
+
+__all__ = [
+    'start_metrics_collection',
+    'collect_project_metrics',
+    'collect_new_metrics'
+]
+
+# Hard time limit of a metrics job, instead of CELERY_TASK_TIME_LIMIT.  A job
+# pauses at its checkpoint after half of it and queues itself again; the
+# other half covers the commit being checked when the time runs out.
+METRICS_JOB_TIME_LIMIT = config('METRICS_JOB_TIME_LIMIT', default=60 * 60, cast=int) # seconds
+
+# Jobs which haven't reported progress for this long are assumed to be lost.
+STALE_JOB_AGE = timedelta(hours=12)
+
+def active_jobs():
+    # A running job reports progress at least once within its time limit, unless it was killed.
+    now = timezone.now()
+    return MetricsJob.objects.filter(Q(status=MetricsJob.JobStatus.QUEUED, updated_at__gte=now - STALE_JOB_AGE) |
+                                     Q(status=MetricsJob.JobStatus.RUNNING,
+                                       updated_at__gte=now - timedelta(seconds=METRICS_JOB_TIME_LIMIT)))
+
+@app.task()
+def start_metrics_collection(incremental: bool = False):
+    busy_projects = set(active_jobs().values_list('project_id', flat=True))
+    queued = 0
+    for project in Project.objects.filter(track_changes=True, installation_id__isnull=False,
+                                          metrics_collected=incremental,
+                                          host_node__isnull=False, host_node__enabled=True):
+        if project.id in busy_projects:
+            continue
+        job = MetricsJob(project=project, node=project.host_node, incremental=incremental)
+        job.save()
+        collect_project_metrics.apply_async([job.id], queue=project.host_node.hostname)
+        queued += 1
+    return queued
+
+@app.task(ignore_result = True, time_limit=METRICS_JOB_TIME_LIMIT)
+def collect_project_metrics(job_id: int):
+    job = MetricsJob.objects.get(id=job_id)
+    if job.status != MetricsJob.JobStatus.QUEUED:
+        return
+    job.status = MetricsJob.JobStatus.RUNNING
+    job.save()
+
+    # Counts carry over from earlier runs of a paused job.
+    processed_before = job.processed_commits
+    relevant_before = job.relevant_commits
+
+    def progress(processed: int, relevant: int):
+        job.processed_commits = processed_before + processed
+        job.relevant_commits = relevant_before + relevant
+        job.save()
+
+    try:
+        # Celery's prefork workers can't start a process pool; projects run side by side instead.
+        with MetricsCollector(workers=1) as collector:
+            collector.collect(job.project, progress, deadline=time.monotonic() + METRICS_JOB_TIME_LIMIT / 2)
+        if not MetricsCheckpoint.objects.filter(project=job.project, complete=True).exists():
+            job.status = MetricsJob.JobStatus.QUEUED
+            job.save()
+            collect_project_metrics.apply_async([job.id], queue=current_node.hostname)
+            return
+        job.status = MetricsJob.JobStatus.DONE
+    except Exception as ex:
+        celery_logger.error(f'Failed to collect metrics for {job.project}: {ex!r}')
+        job.status = MetricsJob.JobStatus.FAILED
+        job.error = repr(ex)
+    job.finished_at = timezone.now()
+    job.save()
+
+@app.task()
+def collect_new_metrics():
+    return start_metrics_collection(incremental=True)
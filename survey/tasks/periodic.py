@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-from .common import app, current_node
+from .common import app, current_node, celery_logger
 
 from celery.result import ResultSet
 
@@ -10,6 +10,7 @@ from django.utils import timezone
 from datetime import timedelta
 
 from .repos  import delete_repo
+from survey.placement import NODE_ACTIVE_WINDOW, node_disk_free
 
 from survey.models import Node, Commit, DeletedRepository
 
@@ -28,7 +29,7 @@ def vacuum_irrelevant_commits():
 @app.task()
 def node_health_check():
 
-    check_time = timezone.now() - timedelta(minutes = 30)
+    check_time = timezone.now() - NODE_ACTIVE_WINDOW
     for node in Node.objects.filter(enabled=True, last_active__lte=check_time):
         node.enabled = False
         node.save()
@@ -40,6 +41,11 @@ def node_health_check():
 def node_health_response():
     current_node.last_active = timezone.now()
     current_node.enabled = True;
+    # The heartbeat is saved regardless, keeping the last known free space.
+    try:
+        current_node.disk_free = node_disk_free()
+    except OSError as ex:
+        celery_logger.error(f'Failed to measure free disk space of {current_node.hostname}: {ex!r}')
     current_node.save()
     return True
 
@@ -7,9 +7,12 @@ from django.db.models import Q
 
 from survey.models import Project, DeletedRepository
 from survey.utils import get_typechecker_configuration, has_annotations, has_language_file
+from survey.git_utils import clone_project, prune_object_pool, share_objects
+from survey.fetches import coalesced_fetch
+from survey.placement import choose_data_subdir, choose_node, record_disk_size, record_fetch
 from git import Repo, GitCommandError
 import os
-import shutil
+from typing import List, Optional, Set, Tuple
 
 __all__ = [
     'install_repo',
@@ -51,7 +54,11 @@ def install_repo(owner: str, repo: str, installation_id: str):
 
     if project.track_changes:
         if project.host_node is None:
-            clone_repo.delay(project.id)
+            node = choose_node(project)
+            if node is not None:
+                clone_repo.apply_async([project.id], queue=node.hostname)
+            else:
+                clone_repo.delay(project.id)
         else:
             fetch_project.apply_async([project.id], queue=project.host_node.hostname)
 
@@ -70,14 +77,13 @@ def clone_repo(project_id):
         return
 
     if current_node.use_datadir_subdirs:
-        locations = { p: shutil.disk_usage(p.readlink()).free for p in settings.DATA_DIR.iterdir() if p.is_symlink() }
-        subdir = max(locations, key=locations.get).parts[-1]
-        project.data_subdir = subdir
+        project.data_subdir = choose_data_subdir(project)
     local_path = project.path
     if not local_path.exists():
         try:
             local_path.parent.mkdir(exist_ok=True, parents=True)
-            repo = Repo.clone_from(project.clone_url, local_path)
+            repo = clone_project(project.clone_url, local_path)
+            share_objects(repo, project.data_root, project.owner, project.name)
         except GitCommandError:
             project.track_changes = False
             project.save()
@@ -87,6 +93,7 @@ def clone_repo(project_id):
 
     project.host_node = current_node
     project.save()
+    record_disk_size(project)
 
     if project.typechecker_files is None:
         project.typechecker_files = get_typechecker_configuration(repo, project.language)
@@ -98,15 +105,19 @@ def clone_repo(project_id):
     project.save()
 
 @app.task(ignore_result = True)
-def fetch_project(project_id: int):
+def fetch_project(project_id: int, shas: Optional[List[str]] = None, ref: Optional[str] = None):
     project = Project.objects.get(id=project_id)
     try:
-        repo = Repo(project.path)
-        repo.remote().fetch()
+        if coalesced_fetch(project, shas, ref):
+            record_fetch(project)
     except:
         clone_repo(project_id)
 
 
+def active_projects(subdir: Optional[str]) -> Set[Tuple[str, str]]:
+    # Projects living in a data directory of this node, whose objects must be kept.
+    return set(Project.objects.filter(host_node=current_node, data_subdir=subdir).values_list('owner', 'name'))
+
 @app.task()
 def rename_repo(old_owner, old_name, new_owner, new_name):
     project = Project.objects.get(Q(owner=old_owner), Q(name=old_name))
@@ -115,14 +126,23 @@ def rename_repo(old_owner, old_name, new_owner, new_name):
     project.name = new_name
     project.save()
     old_path.rename(project.path)
+    # Shared objects are kept under the new name before the old one is dropped.
+    if share_objects(Repo(project.path), project.data_root, new_owner, new_name):
+        prune_object_pool(project.data_root, active_projects(project.data_subdir))
 
 @app.task()
 def delete_repo(deleted_pk):
     repo = DeletedRepository.objects.get(id=deleted_pk)
     if repo.subdir is not None:
-        path = settings.DATA_DIR / repo.subdir / repo.owner / repo.name
+        data_root = settings.DATA_DIR / repo.subdir
     else:
-        path = settings.DATA_DIR / repo.owner / repo.name
+        data_root = settings.DATA_DIR
+    path = data_root / repo.owner / repo.name
+    active = active_projects(repo.subdir)
+    if (repo.owner, repo.name) in active:
+        # The project was cloned here again since, e.g. after a re-install.
+        repo.delete()
+        return
     if path.exists():
         for root, dirs, files in os.walk(path, topdown=False):
             for name in files:
@@ -133,4 +153,5 @@ def delete_repo(deleted_pk):
     path.rmdir()
     if len(list(parent.iterdir())) == 0:
         parent.rmdir()
+    prune_object_pool(data_root, active)
     repo.delete()
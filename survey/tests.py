@@ -1,3 +1,329 @@
-from django.test import TestCase
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import whatthepatch
+from django.test import SimpleTestCase
+from git import Repo
+
+from survey import annotation_diff
+from survey.ast_diff import LineIndex, Match, TypeTreeIndex
+from survey.git_walker import commit_changes, walk_commits
+from survey.patch_filter import filter_paths
+from survey.patches import FilePatch, commit_patches
+from survey.utils import DETECTOR_VERSION, ChangeType, check_revision_is_relevant, detector_version
+
+def actions(a_source: str, b_source: str, language: str):
+    diff = annotation_diff.diff_annotations(a_source.encode(), b_source.encode(), language)
+    return [(action['action'], action['tree'].split(' ')[0]) for action in diff['actions']]
+
+@skipUnless(annotation_diff.is_available('python'), 'tree-sitter Python grammar not available')
+class PythonAnnotationDiffTests(SimpleTestCase):
+
+    source = ('def foo(x: int, y: str) -> bool:\n'
+              '    z: int = 1\n'
+              '    return True\n')
+
+    def test_unchanged(self):
+        self.assertEqual(actions(self.source, self.source, 'python'), [])
+
+    def test_function_rename(self):
+        self.assertEqual(actions(self.source, self.source.replace('foo', 'bar'), 'python'), [])
+
+    def test_parameter_rename(self):
+        self.assertEqual(actions(self.source, self.source.replace('x', 'w'), 'python'), [])
+
+    def test_class_rename(self):
+        source = 'class A:\n    x: int\n    def f(self) -> None: ...\n'
+        self.assertEqual(actions(source, source.replace('A', 'B'), 'python'), [])
+
+    def test_rename_with_changed_annotation(self):
+        renamed = self.source.replace('foo', 'bar').replace('x: int', 'x: float')
+        self.assertEqual(actions(self.source, renamed, 'python'), [('update-node', 'type')])
+
+    def test_removed_annotation(self):
+        self.assertEqual(actions(self.source, self.source.replace('y: str', 'y'), 'python'),
+                         [('delete-tree', 'type')])
+
+    def test_added_annotation(self):
+        self.assertEqual(actions(self.source, self.source + 'def g(q: int): pass\n', 'python'),
+                         [('insert-tree', 'type')])
+
+    def test_non_ascii_offsets(self):
+        # Spans are character offsets into the decoded source, not byte offsets.
+        source = 'é = "ü"\ndef f(x: int): pass\n'
+        diff = annotation_diff.diff_annotations(source.encode(), source.replace('x: int', 'x').encode(), 'python')
+        self.assertEqual([action['tree'] for action in diff['actions']],
+                         [f'type [{source.index("int")},{source.index("int") + 3}]'])
+
+    def test_replaced_function(self):
+        replaced = 'def bar(w: float) -> bool:\n    z: int = 1\n    return True\n'
+        self.assertEqual(sorted(actions('def foo(x: int) -> bool:\n    z: int = 1\n    return True\n', replaced, 'python')),
+                         [('delete-tree', 'type'), ('insert-tree', 'type')])
+
+    def test_annotation_moved_to_another_parameter(self):
+        self.assertEqual(sorted(actions('def f(a: int, b): pass\n', 'def f(a, b: int): pass\n', 'python')),
+                         [('delete-tree', 'type'), ('insert-tree', 'type')])
+
+    def test_annotation_moved_to_another_function(self):
+        self.assertEqual(sorted(actions('def f() -> None: pass\ndef g(): pass\n',
+                                        'def f(): pass\ndef g() -> None: pass\n', 'python')),
+                         [('delete-tree', 'type'), ('insert-tree', 'type')])
+
+@skipUnless(annotation_diff.is_available('typescript'), 'tree-sitter TypeScript grammar not available')
+class TypeScriptAnnotationDiffTests(SimpleTestCase):
+
+    source = 'function foo(a: number): string { let q: number = 1; return ""; }\n'
+
+    def test_function_rename(self):
+        self.assertEqual(actions(self.source, self.source.replace('foo', 'bar'), 'typescript'), [])
+
+    def test_parameter_rename(self):
+        self.assertEqual(actions(self.source, self.source.replace('a:', 'b:'), 'typescript'), [])
+
+    def test_changed_annotation(self):
+        self.assertEqual(actions(self.source, self.source.replace('a: number', 'a: string'), 'typescript'),
+                         [('update-node', 'type_annotation')])
+
+    def test_annotation_moved_to_another_parameter(self):
+        self.assertEqual(sorted(actions('function f(a: number, b) {}\n', 'function f(a, b: number) {}\n', 'typescript')),
+                         [('delete-tree', 'type_annotation'), ('insert-tree', 'type_annotation')])
+
+    def test_annotation_moved_to_another_function(self):
+        self.assertEqual(sorted(actions('function f(): void {}\nfunction g() {}\n',
+                                        'function f() {}\nfunction g(): void {}\n', 'typescript')),
+                         [('delete-tree', 'type_annotation'), ('insert-tree', 'type_annotation')])
+
+class TypeTreeIndexTests(SimpleTestCase):
+
+    index = TypeTreeIndex([(10, 20), (0, 5), (12, 30)])
+
+    def test_within_span(self):
+        self.assertTrue(self.index.contains(0, 5))
+        self.assertTrue(self.index.contains(13, 19))
+        # Only within the later, longer span.
+        self.assertTrue(self.index.contains(21, 25))
+
+    def test_outside_spans(self):
+        self.assertFalse(self.index.contains(6, 8))
+        self.assertFalse(self.index.contains(3, 7))
+        self.assertFalse(self.index.contains(29, 31))
+
+    def test_empty(self):
+        self.assertFalse(TypeTreeIndex([]).contains(0, 0))
+
+    def test_from_matches(self):
+        index = TypeTreeIndex.from_matches([Match.from_json({'src': 'type [3,9]', 'dest': 'type [4,10]'}),
+                                            Match.from_json({'src': 'identifier: x [0,2]', 'dest': 'identifier: x [0,2]'})])
+        self.assertEqual(len(index), 1)
+        self.assertTrue(index.contains(4, 9))
+        self.assertFalse(index.contains(0, 2))
+        self.assertTrue(TypeTreeIndex.from_matches([Match.from_json({'src': 'type [3,9]', 'dest': 'type [4,10]'})],
+                                                   'b').contains(4, 10))
+
+class LineIndexTests(SimpleTestCase):
+
+    lines = LineIndex('a\nbc\n\nd')
+
+    def test_line_of(self):
+        self.assertEqual(len(self.lines), 4)
+        self.assertEqual([self.lines.line_of(offset) for offset in range(7)], [1, 1, 2, 2, 2, 3, 4])
+
+    def test_line_text(self):
+        self.assertEqual([self.lines.line_text(line) for line in range(1, 5)], ['a', 'bc', '', 'd'])
+        with self.assertRaises(IndexError):
+            self.lines.line_text(0)
+
+class FilePatchTests(SimpleTestCase):
+
+    text = ('@@ -1,3 +1,3 @@\n'
+            ' def f(x):\n'
+            '-    return x\n'
+            '+    return x + 1\n'
+            ' # end\n'
+            '@@ -10,2 +10,3 @@ def g():\n'
+            ' a = 1\n'
+            '+b: int = 2\n'
+            ' c = 3')
+
+    def setUp(self):
+        self.patch = FilePatch('a.py', self.text, next(whatthepatch.parse_patch(self.text)))
+
+    def test_position(self):
+        self.assertEqual(self.patch.position(1), 1)
+        self.assertEqual(self.patch.position(2), 3)
+        # Later hunk headers count as lines too.
+        self.assertEqual(self.patch.position(11), 7)
+        self.assertEqual(self.patch.position(12), 8)
+
+    def test_old_position(self):
+        self.assertEqual(self.patch.position(2, old=True), 2)
+        self.assertEqual(self.patch.position(11, old=True), 8)
+
+    def test_outside_hunks(self):
+        self.assertIsNone(self.patch.position(5))
+        self.assertIsNone(self.patch.position(5, old=True))
+
+    def test_lines_changed(self):
+        self.assertEqual(self.patch.lines_changed, 3)
+
+class GitRepositoryTestCase(SimpleTestCase):
+    # A small repository, built once per test case.
+
+    @classmethod
+    def git(cls, *args: str) -> str:
+        env = {**os.environ,
+               'GIT_AUTHOR_NAME': 'Test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+               'GIT_COMMITTER_NAME': 'Test', 'GIT_COMMITTER_EMAIL': 'test@example.com'}
+        return subprocess.run(['git', *args], cwd=cls.path, env=env, check=True,
+                              capture_output=True, text=True).stdout.strip()
+
+    @classmethod
+    def commit(cls, message: str, files: dict) -> str:
+        for name, content in files.items():
+            if content is None:
+                (cls.path / name).unlink()
+            else:
+                (cls.path / name).write_text(content)
+        cls.git('add', '-A')
+        cls.git('commit', '-q', '-m', message)
+        return cls.git('rev-parse', 'HEAD')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.path = Path(cls.tmp.name)
+        cls.git('init', '-q', '-b', 'main')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+class WalkCommitsTests(GitRepositoryTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = cls.commit('root', {'a.py': 'x = 1\n', 'b.txt': 'b\n'})
+        cls.change = cls.commit('change', {'a.py': 'x: int = 1\n', 'b.txt': None, 'c.py': 'c = 1\n'})
+        cls.git('checkout', '-q', '-b', 'side')
+        cls.side = cls.commit('side', {'c.py': 'c = 2\n'})
+        cls.git('checkout', '-q', 'main')
+        cls.main = cls.commit('main', {'a.py': 'x: int = 2\n'})
+        # Renamed and edited.
+        cls.rename = cls.commit('rename', {'a.py': None, 'd.py': 'x: int = 2\ny = 3\n'})
+        cls.git('merge', '-q', '--no-ff', '-m', 'merge', 'side')
+        cls.merge = cls.git('rev-parse', 'HEAD')
+
+    def test_records(self):
+        records = {record.sha: record for record in walk_commits(self.path)}
+        self.assertEqual(set(records), {self.root, self.change, self.side, self.main, self.rename, self.merge})
+        self.assertTrue(records[self.root].is_root)
+        self.assertEqual(records[self.change].parents, (self.root,))
+        self.assertTrue(records[self.merge].is_merge)
+        # Merges are reported without changes.
+        self.assertEqual(records[self.merge].changes, ())
+
+    def test_changes(self):
+        record = next(record for record in walk_commits(self.path) if record.sha == self.change)
+        self.assertEqual(sorted((change.status, change.path) for change in record.changes),
+                         [('A', 'c.py'), ('D', 'b.txt'), ('M', 'a.py')])
+        deleted = next(change for change in record.changes if change.status == 'D')
+        self.assertIsNone(deleted.new_blob)
+        self.assertEqual(deleted.old_blob, self.git('rev-parse', f'{self.root}:b.txt'))
+
+    def test_modified_paths(self):
+        records = {record.sha: record for record in walk_commits(self.path)}
+        # Added and deleted files have nothing to diff, unless they may be a rename.
+        self.assertEqual(records[self.main].modified_paths(), ['a.py'])
+        self.assertEqual(records[self.side].modified_paths(), ['c.py'])
+        self.assertEqual(sorted(records[self.change].modified_paths()), ['a.py', 'b.txt', 'c.py'])
+
+    def test_revisions(self):
+        self.assertEqual([record.sha for record in walk_commits(self.path, f'{self.root}..{self.change}')],
+                         [self.change])
+
+    def test_commit_changes(self):
+        changes = commit_changes(self.path, self.change)
+        self.assertEqual(sorted((change.status, change.path) for change in changes),
+                         [('A', 'c.py'), ('D', 'b.txt'), ('M', 'a.py')])
+        self.assertEqual(sorted(change.path for change in commit_changes(self.path, self.root)), ['a.py', 'b.txt'])
+
+    def test_commit_changes_renames(self):
+        self.assertEqual([(change.status, change.path, change.old_path)
+                          for change in commit_changes(self.path, self.rename, renames=True)],
+                         [('R', 'd.py', 'a.py')])
+        self.assertEqual(sorted((change.status, change.path) for change in commit_changes(self.path, self.rename)),
+                         [('A', 'd.py'), ('D', 'a.py')])
+
+@skipUnless(annotation_diff.is_available('python'), 'tree-sitter Python grammar not available')
+class CheckRevisionTests(GitRepositoryTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.commit('base', {'mod.py': 'x = 1\ndef f(a): pass\ndef g(b: int): pass\n'})
+        # Lines added at the top shift the new file against the old one.
+        cls.change = cls.commit('change', {'mod.py': '# 1\n# 2\n# 3\n# 4\nx = 1\n'
+                                                     'def f(a: str): pass\ndef g(b): pass\n'})
+        cls.rename = cls.commit('rename', {'mod.py': None,
+                                           'renamed.py': '# 1\n# 2\n# 3\n# 4\nx = 1\n'
+                                                         'def f(a: str): pass\ndef g(b): pass\ndef h(c: int): pass\n'})
+
+    def test_shifted_lines(self):
+        with mock.patch('survey.ast_diff.AST_DIFF_CACHE', ''), mock.patch('survey.ast_diff.AST_DIFF_ENGINE', 'tree-sitter'):
+            changes = check_revision_is_relevant(Repo(self.path), 'PY', self.change)
+        # The annotation added to `f' is on its new line, the one removed from `g' on its old line.
+        self.assertEqual(sorted((change.file, change.line, change.change_type, change.position) for change in changes),
+                         [('mod.py', 3, ChangeType.REMOVED, 7), ('mod.py', 6, ChangeType.ADDED, 8)])
+
+    def test_renamed_file(self):
+        # The file renamed along with the change is diffed against its old path.
+        with mock.patch('survey.ast_diff.AST_DIFF_CACHE', ''), mock.patch('survey.ast_diff.AST_DIFF_ENGINE', 'tree-sitter'):
+            for changed_files in (None, ['mod.py', 'renamed.py']):
+                for first_only in (False, True):
+                    changes = check_revision_is_relevant(Repo(self.path), 'PY', self.rename, changed_files, first_only)
+                    self.assertEqual([(change.file, change.line, change.change_type) for change in changes],
+                                     [('renamed.py', 8, ChangeType.ADDED)])
+
+class DetectorVersionTests(SimpleTestCase):
+
+    def test_gumtree(self):
+        with mock.patch('survey.ast_diff.AST_DIFF_ENGINE', 'gumtree'):
+            self.assertEqual(detector_version('PY'), f'{DETECTOR_VERSION}-gumtree')
+
+    def test_language_without_backend(self):
+        # PHP and R projects have no diff backend to ask.
+        with mock.patch('survey.utils.AST_DIFF_ENGINE', 'tree-sitter'):
+            self.assertEqual(detector_version('PH'), f'{DETECTOR_VERSION}-tree-sitter')
+            self.assertEqual(detector_version('RL'), f'{DETECTOR_VERSION}-tree-sitter')
+
+class FilterPathsTests(GitRepositoryTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.commit('base', {'typed.py': 'x = 1\n',
+                            'plain.py': 'z: int = 0\ny = 1\n',
+                            'comment.py': 'y = 1  # y: int\n'})
+        cls.commit('change', {'typed.py': 'x: int = 1\n',
+                              'plain.py': 'z: int = 0\ny = 2\n',
+                              'comment.py': 'y = 1  # y: str\n'})
+        cls.patches = commit_patches(Repo(cls.path).head.commit)
+
+    def test_filter(self):
+        self.assertEqual(filter_paths(self.patches, ['typed.py', 'plain.py', 'comment.py', 'other.py'], 'py', 'on'),
+                         ['typed.py', 'other.py'])
+
+    def test_conservative(self):
+        # Context lines, strings and comments count as well.
+        self.assertEqual(filter_paths(self.patches, ['typed.py', 'plain.py', 'comment.py'], 'py', 'conservative'),
+                         ['typed.py', 'plain.py', 'comment.py'])
+
+    def test_off(self):
+        self.assertIsNone(filter_paths(self.patches, ['plain.py'], 'py', 'off'))
+        self.assertIsNone(filter_paths(self.patches, ['plain.py'], 'rb', 'on'))
@@ -2,30 +2,29 @@
 # coding: utf-8
 
 import tomllib, json
+import logging
 import re
-from typing import List, Optional, Tuple
+from typing import List, NamedTuple, Optional, Tuple
 import git
 from git import Repo
 from .models import Commit, Project
 from django.db.models import Q
-from .ast_diff import AstDiff
-import whatthepatch
+from .ast_diff import AstDiff, LANGUAGE_BACKENDS, LANGUAGE_EXTENSIONS, AST_DIFF_ENGINE, AST_DIFF_PREFILTER, DiffFailure, count, diff_backend, is_tree_sitter_backend
+from .git_utils import promisor_remote
+from .git_walker import commit_changes
+from .patch_filter import filter_paths
+from .patches import FilePatch, commit_patches
 import ast
 from pathlib import Path
 
 from enum import StrEnum, auto
 
+logger = logging.getLogger(__name__)
+
 python_file_check = re.compile(r'\.pyi?$', re.IGNORECASE)
 typescript_file_check = re.compile(r'\.ts$', re.IGNORECASE)
 php_file_check = re.compile(r'\.php$', re.IGNORECASE)
 
-insert_re = re.compile(r'^insert-(tree|node)', re.IGNORECASE)
-update_re = re.compile(r'^update-(tree|node)', re.IGNORECASE)
-
-position_re = re.compile(r'\[(\d+),(\d+)\]', re.IGNORECASE)
-
-tree_re = re.compile(r'^(typed_parameter|type_annotation|type|union_type|help)', re.IGNORECASE)
-
 def get_typechecker_configuration(repo, language: Project.ProjectLanguage, commit_like: str='HEAD'):
     typecheckers = []
     if language == Project.ProjectLanguage.PYTHON:
@@ -134,10 +133,9 @@ def has_annotations(repo, language):
 
 def has_language_file(repo, language):
     match language:
-        case Project.ProjectLanguage.PYTHON:
-            return len(list(Path(repo.working_tree_dir).glob('**/*.py'))) > 0
-        case Project.ProjectLanguage.TYPESCRIPT:
-            return len(list(Path(repo.working_tree_dir).glob('**/*.ts'))) > 0
+        case Project.ProjectLanguage.PYTHON | Project.ProjectLanguage.TYPESCRIPT:
+            return any(next(Path(repo.working_tree_dir).glob(f'**/*{extension}'), None) is not None
+                       for extension in LANGUAGE_EXTENSIONS[language.lower()])
         case _:
             return False
 
@@ -151,102 +149,180 @@ def file_is_relevant(name: str, language: str) -> bool:
             return False
 
 
+# Bump whenever a change to the relevance check may change its results, so
+# that stored results get re-evaluated.
+DETECTOR_VERSION = 2
+
+def detector_version(language: str) -> str:
+    # The engine which actually runs: tree-sitter falls back to GumTree when
+    # it has no grammar for the language.  Languages without any backend
+    # (PHP and R projects) are versioned by the configured engine.
+    language = language.lower()
+    if language not in LANGUAGE_BACKENDS:
+        return f'{DETECTOR_VERSION}-{AST_DIFF_ENGINE}'
+    engine = 'tree-sitter' if is_tree_sitter_backend(diff_backend(language)) else 'gumtree'
+    return f'{DETECTOR_VERSION}-{engine}'
+
 class ChangeType(StrEnum):
     ADDED = auto()
     REMOVED = auto()
     CHANGED = auto()
 
-def check_commit_is_relevant(repo: Repo, commit: Commit) -> Optional[List[Tuple[str, int, ChangeType]]]:
-    language = commit.project.language
-    git_commit = repo.rev_parse(commit.hash)
+def change_type_to_relevance_type(change_type: ChangeType):
+    match change_type:
+        case ChangeType.ADDED:
+            return Commit.RelevanceType.ADDED
+        case ChangeType.REMOVED:
+            return Commit.RelevanceType.REMOVED
+        case ChangeType.CHANGED:
+            return Commit.RelevanceType.CHANGED
+        case _:
+            return Commit.RelevanceType.CHANGED
+
+class DetectedChange(NamedTuple):
+    file: str
+    line: int
+    change_type: ChangeType
+    node_kind: str
+    # Position within the file's patch, as used for commit comments.
+    position: Optional[int] = None
+
+def check_commit_is_relevant(repo: Repo, commit: Commit, first_only: bool = False) -> Optional[List[DetectedChange]]:
+    return check_revision_is_relevant(repo, commit.project.language, commit.hash, first_only=first_only)
+
+def relevance_likelihood(path: str, patch: Optional[FilePatch]) -> Tuple[int, int]:
+    # Sort key putting likely relevant files first: stubs only hold
+    # annotations, then files with more changed lines.
+    return (0 if path.lower().endswith('.pyi') else 1,
+            -(patch.lines_changed if patch is not None else 0))
+
+def check_revision_is_relevant(repo: Repo, language: str, sha: str,
+                               changed_files: Optional[List[str]] = None,
+                               first_only: bool = False) -> Optional[List[DetectedChange]]:
+    # With `first_only', files are diffed one at a time, most likely first, and
+    # only the first relevant change found is returned.
+    git_commit = repo.rev_parse(sha)
 
     # Check if it's a merge: merges aren't interesting, but their children may already have been...
     if len(git_commit.parents) > 1:
         return None
 
-    # List of changed files is in the stats field of a commit
-    changes = git_commit.stats.files
+    # The changed files (and their blobs) come from the commit's trees, unless the caller
+    # already knows them; a commit's stats would read every changed file.
+    partial_clone = promisor_remote(repo) is not None
+    file_changes = []
+    if changed_files is None or partial_clone:
+        file_changes = commit_changes(repo.git_dir, sha)
+    if changed_files is None:
+        changed_files = [change.path for change in file_changes]
     possibly_relevant_files = []
-    for file, change_data in changes.items():
+    for file in changed_files:
         if file_is_relevant(str(file), language):
             possibly_relevant_files.append(file)
 
     if len(possibly_relevant_files) > 0:
+        if partial_clone:
+            # Only the blobs of the files which may be relevant, all at once, before anything reads them.
+            relevant = set(possibly_relevant_files)
+            AstDiff.prefetch_paths(git_commit,
+                                   [blob for change in file_changes if change.path in relevant
+                                    for blob in (change.old_blob, change.new_blob) if blob is not None],
+                                   possibly_relevant_files)
+
+        # A renamed file is listed as a deleted and an added file, whose paths are diffed together.
+        statuses = {change.path: change.status for change in file_changes}
+        if len(file_changes) > 0:
+            may_rename = (any(statuses.get(file) == 'A' for file in possibly_relevant_files) and
+                          any(statuses.get(file) == 'D' for file in possibly_relevant_files))
+        else:
+            may_rename = len(possibly_relevant_files) > 1
+        if may_rename:
+            # The contents of a partial clone have been fetched by now.
+            units = [[change.old_path, change.path] if change.old_path is not None else [change.path]
+                     for change in commit_changes(repo.git_dir, sha, possibly_relevant_files, renames=True)
+                     if change.status not in ('A', 'D')]
+        else:
+            units = [[file] for file in possibly_relevant_files if statuses.get(file) not in ('A', 'D')]
+        if len(units) == 0:
+            return None
+
+        # Patches come from the local clone; GitHub is only needed to post comments.
+        patches = commit_patches(git_commit, possibly_relevant_files)
+
+        # Units are known by the path in the commit.
+        candidate_files = filter_paths(patches, [unit[-1] for unit in units], language.lower(), AST_DIFF_PREFILTER)
+        if candidate_files is not None:
+            count('prefilter_skipped', len(units) - len(candidate_files))
+            count('prefilter_passed', len(candidate_files))
+            if len(candidate_files) == 0:
+                return None
+            candidates = set(candidate_files)
+            units = [unit for unit in units if unit[-1] in candidates]
+
+        if first_only:
+            units = sorted(units, key=lambda unit: relevance_likelihood(unit[-1], patches.get(unit[-1])))
+            file_groups = units
+        else:
+            file_groups = [[path for unit in units for path in unit]]
+
         changes = []
-        diffs = git_commit.diff(git_commit.parents[0], paths=possibly_relevant_files)
-        for diff in diffs:
-            gh_diff = None
-            patch_str = ""
-            patch = None
-            for gh_diff_obj in commit.gh.files:
-                if gh_diff_obj.filename == diff.b_path:
-                    gh_diff = gh_diff_obj
-                    patch_str = gh_diff.patch
-                    patch = list(whatthepatch.parse_patch(patch_str))[0]
-                    break
-            try:
-                astdiff = AstDiff.from_diff(git_commit, diff, language.lower())
-                relevant_changes = is_diff_relevant(astdiff)
-                if relevant_changes:
-                    for file, line, is_added in relevant_changes:
-                        diff_index = 0
-                        for i, change in enumerate(patch.changes):
-                            if is_added:
-                                if change.new == line:
-                                    diff_index = patch_str.count('\n', 0, patch_str.find(change.line))
-                                    break
-                            else:
-                                if change.old == line:
-                                    change_rem_line = astdiff.a_data.split('\n')[line - 1]
-                                    diff_index = patch_str.count('\n', 0, patch_str.find(change_rem_line))
-                                    break
-                        changes.append((file, diff_index, is_added))
-                    # changes.extend(relevant_changes)
-            except:
-                continue
+        for group_index, paths in enumerate(file_groups):
+            for diff, astdiff in AstDiff.batch_from_commit(git_commit, language.lower(), paths, prefetch=False):
+                # Failed diffs have already been classified and counted.
+                if isinstance(astdiff, Exception):
+                    continue
+                # The diff is taken against the parent, so a renamed file's path in the commit is `a_path'.
+                patch = patches.get(diff.a_path or '') or patches.get(diff.b_path or '')
+                try:
+                    relevant_changes = is_diff_relevant(astdiff)
+                    if relevant_changes:
+                        for change in relevant_changes:
+                            # Added trees are on lines of the new file, the others on lines of the
+                            # old one; lines outside the patch get no position.
+                            diff_index = None
+                            if patch is not None:
+                                diff_index = patch.position(change.line, old=(change.change_type != ChangeType.ADDED))
+                            changes.append(change._replace(position=diff_index))
+                except Exception as ex:
+                    count(f'failed_{language.lower()}_{DiffFailure.ERROR}')
+                    logger.warning(f'Failed to check {diff.b_path} in {sha}: {ex!r}')
+                    continue
+            if first_only and len(changes) > 0:
+                count('early_exit_skipped', len(file_groups) - group_index - 1)
+                return changes[:1]
         if len(changes) == 0:
             return None
         return changes
 
     return None
 
-def locate_type_tree(diff: AstDiff, start: int, end: int) -> bool:
-
-    for match in diff.matches:
-        if tree_re.match(match['src']):
-            #print('matched', match)
-            position_start, position_end = list(map(int, position_re.search(match['src']).groups()))
-            if position_start <= start and end <= position_end:
-                return True
+def locate_type_tree(diff: AstDiff, start: int, end: int, side: str = 'a') -> bool:
+    return diff.type_trees(side).contains(start, end)
 
-    return False
-
-def is_diff_relevant(diff: AstDiff) -> Optional[List[Tuple[str, int, ChangeType]]]:
+def is_diff_relevant(diff: AstDiff) -> Optional[List[DetectedChange]]:
     relevant_changes = []
     for action in diff.actions:
-        added = True if insert_re.search(action['action']) else False
-        updated = True if update_re.search(action['action']) else False
+        added = action.type.is_insert
+        updated = action.type.is_update
         change_type = (ChangeType.ADDED if added else (ChangeType.CHANGED if updated else ChangeType.REMOVED))
 
-        position_string = action['parent' if not (added or updated) else 'tree']
-        position_start, position_end = list(map(int, position_re.search(position_string).groups()))
+        position = action.tree if (added or updated) else (action.parent or action.tree)
 
-        linenum = -1
-        if added or updated:
-            linenum = diff.a_data.count('\n', 0, position_start) + 1
-        else:
-            linenum = diff.b_data.count('\n', 0, position_start) + 1
+        # Inserted trees are in the new text (`b'), deleted and updated ones in the old text (`a').
+        side = 'b' if added else 'a'
+        linenum = diff.line_of(position.start, side)
 
         is_relevant = False
 
-        if tree_re.match(action['tree']):
+        if action.tree.is_type:
             is_relevant = True
 
-        if locate_type_tree(diff, position_start, position_end):
+        if locate_type_tree(diff, position.start, position.end, side):
             is_relevant = True
 
         if is_relevant:
-            relevant_changes.append((diff.b_name, linenum, change_type))
+            # Changes are reported against the file's path in the commit.
+            relevant_changes.append(DetectedChange(diff.a_name, linenum, change_type, action.tree.kind))
 
     if len(relevant_changes) > 0:
         return relevant_changes